@@ -0,0 +1,310 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from config import CALIBRATION_DIR, DRONE_ID, HEADLESS
+
+
+def calibration_path(drone_id: str = DRONE_ID) -> str:
+    """Путь к файлу калибровки камеры дрона"""
+    return os.path.join(CALIBRATION_DIR, f"{drone_id}.json")
+
+
+class CameraCalibration:
+    """Внутренние параметры камеры и кэш карт устранения дисторсии"""
+
+    def __init__(self, camera_matrix, dist_coeffs, image_size: Optional[Tuple[int, int]] = None,
+                 reprojection_error: Optional[float] = None):
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64).reshape(3, 3)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64).reshape(1, -1)
+        self.image_size = tuple(image_size) if image_size else None  # (ширина, высота)
+        self.reprojection_error = reprojection_error
+        self._maps = None
+        self._maps_size = None
+
+    @property
+    def has_distortion(self) -> bool:
+        return bool(np.any(np.abs(self.dist_coeffs) > 1e-9))
+
+    def matrix_for_size(self, image_size: Tuple[int, int]) -> np.ndarray:
+        """Матрица камеры для кадра другого разрешения"""
+        if not self.image_size or tuple(image_size) == self.image_size:
+            return self.camera_matrix
+        scale_x = image_size[0] / self.image_size[0]
+        scale_y = image_size[1] / self.image_size[1]
+        matrix = self.camera_matrix.copy()
+        matrix[0, :] *= scale_x
+        matrix[1, :] *= scale_y
+        return matrix
+
+    def normalize_points(self, image_points: np.ndarray, image_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """Перевод пикселей в нормализованные координаты без дисторсии (N, 2)"""
+        matrix = self.matrix_for_size(image_size) if image_size else self.camera_matrix
+        points = np.asarray(image_points, dtype=np.float64).reshape(-1, 1, 2)
+        return cv2.undistortPoints(points, matrix, self.dist_coeffs).reshape(-1, 2)
+
+    def undistort_maps(self, image_size: Tuple[int, int]):
+        """Карты устранения дисторсии (считаются один раз для размера кадра)"""
+        if self._maps is None or self._maps_size != tuple(image_size):
+            matrix = self.matrix_for_size(image_size)
+            self._maps = cv2.initUndistortRectifyMap(
+                matrix, self.dist_coeffs, None, matrix, tuple(image_size), cv2.CV_16SC2
+            )
+            self._maps_size = tuple(image_size)
+        return self._maps
+
+    def to_dict(self) -> dict:
+        return {
+            'camera_matrix': self.camera_matrix.tolist(),
+            'dist_coeffs': self.dist_coeffs.reshape(-1).tolist(),
+            'image_size': list(self.image_size) if self.image_size else None,
+            'reprojection_error': self.reprojection_error,
+            'created': datetime.utcnow().isoformat(timespec='seconds'),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'CameraCalibration':
+        return cls(
+            data['camera_matrix'],
+            data.get('dist_coeffs', [0, 0, 0, 0, 0]),
+            data.get('image_size'),
+            data.get('reprojection_error')
+        )
+
+
+def load_calibration(path: str) -> CameraCalibration:
+    with open(path, encoding='utf-8') as f:
+        return CameraCalibration.from_dict(json.load(f))
+
+
+def save_calibration(calibration: CameraCalibration, path: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(calibration.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+# Параметры доски ChArUco для калибровки
+CHARUCO_SQUARES = (5, 7)        # клеток по горизонтали и вертикали
+CHARUCO_SQUARE_LENGTH = 0.03    # сторона клетки, м
+CHARUCO_MARKER_LENGTH = 0.022   # сторона маркера, м
+CHARUCO_DICTIONARY = cv2.aruco.DICT_5X5_100
+
+
+def make_charuco_board(squares=CHARUCO_SQUARES, square_length=CHARUCO_SQUARE_LENGTH,
+                       marker_length=CHARUCO_MARKER_LENGTH, dictionary=CHARUCO_DICTIONARY):
+    aruco_dict = cv2.aruco.getPredefinedDictionary(dictionary)
+    return cv2.aruco.CharucoBoard(tuple(squares), square_length, marker_length, aruco_dict)
+
+
+class CharucoView:
+    """Вид доски на одном кадре: найденные углы и признаки для отбора кадров"""
+
+    def __init__(self, object_points, image_points, image_size, source=None):
+        self.object_points = object_points
+        self.image_points = image_points
+        self.image_size = image_size
+        self.source = source
+        points = image_points.reshape(-1, 2)
+        width, height = image_size
+        hull_area = cv2.contourArea(cv2.convexHull(points.astype(np.float32)))
+        # Положение центра доски, ее видимый размер и вытянутость (наклон)
+        spread = np.std(points, axis=0) / np.array([width, height])
+        self.features = np.array([
+            points[:, 0].mean() / width,
+            points[:, 1].mean() / height,
+            np.sqrt(hull_area / (width * height)),
+            spread[0] / max(spread[1], 1e-6) * 0.25,
+        ])
+
+
+def detect_charuco_view(image, board, min_corners: int = 8, source=None) -> Optional[CharucoView]:
+    """Поиск доски ChArUco на изображении"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    detector = cv2.aruco.CharucoDetector(board)
+    charuco_corners, charuco_ids, _, _ = detector.detectBoard(gray)
+    if charuco_ids is None or len(charuco_ids) < min_corners:
+        return None
+    object_points, image_points = board.matchImagePoints(charuco_corners, charuco_ids)
+    if object_points is None or len(object_points) < min_corners:
+        return None
+    return CharucoView(object_points, image_points, (gray.shape[1], gray.shape[0]), source)
+
+
+def _detect_file_worker(args):
+    path, board_params, min_corners = args
+    image = cv2.imread(path)
+    if image is None:
+        return None
+    return detect_charuco_view(image, make_charuco_board(*board_params), min_corners, source=path)
+
+
+def select_spread_views(views, count: int, seed: int = 0):
+    """Отбор хорошо разнесенных кадров: жадный выбор самых удаленных по признакам"""
+    if len(views) <= count:
+        return list(views)
+    features = np.array([view.features for view in views])
+    rng = np.random.default_rng(seed)
+    selected = [int(rng.integers(len(views)))]
+    distances = np.linalg.norm(features - features[selected[0]], axis=1)
+    while len(selected) < count:
+        next_index = int(np.argmax(distances))
+        selected.append(next_index)
+        distances = np.minimum(distances, np.linalg.norm(features - features[next_index], axis=1))
+    return [views[i] for i in selected]
+
+
+def _calibrate_worker(args):
+    object_points, image_points, image_size = args
+    error, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera(
+        object_points, image_points, image_size, None, None
+    )
+    return error, camera_matrix, dist_coeffs
+
+
+def _subset_args(views, image_size):
+    return (
+        [view.object_points for view in views],
+        [view.image_points for view in views],
+        image_size
+    )
+
+
+def holdout_error(camera_matrix, dist_coeffs, views) -> float:
+    """Ошибка репроекции (px) на кадрах, не участвовавших в калибровке"""
+    squared, count = 0.0, 0
+    for view in views:
+        ok, rvec, tvec = cv2.solvePnP(view.object_points, view.image_points, camera_matrix, dist_coeffs)
+        if not ok:
+            continue
+        projected, _ = cv2.projectPoints(view.object_points, rvec, tvec, camera_matrix, dist_coeffs)
+        diff = projected.reshape(-1, 2) - view.image_points.reshape(-1, 2)
+        squared += float(np.sum(diff ** 2))
+        count += len(diff)
+    return float(np.sqrt(squared / count)) if count else float('inf')
+
+
+def calibrate_from_views(views, subset_size: int = 25, attempts: int = 4, workers: Optional[int] = None) -> CameraCalibration:
+    """Калибровка по нескольким разнесенным подмножествам кадров в пуле процессов.
+
+    Ошибки репроекции разных подмножеств несравнимы, поэтому часть кадров
+    откладывается как контрольная (общая для всех попыток) и выбирается
+    результат с наименьшей ошибкой на ней. Если кадров не больше subset_size
+    (без контрольных), все попытки совпали бы - выполняется одна калибровка
+    по всем кадрам.
+    """
+    if len(views) < 4:
+        raise ValueError(f"Недостаточно кадров с доской для калибровки: {len(views)}")
+    image_size = views[0].image_size
+    holdout_count = max(2, len(views) // 5)
+    if attempts <= 1 or len(views) - holdout_count <= subset_size:
+        error, camera_matrix, dist_coeffs = _calibrate_worker(_subset_args(views, image_size))
+        print(f"Калибровка по {len(views)} кадрам: ошибка репроекции {error:.3f} px")
+        return CameraCalibration(camera_matrix, dist_coeffs, image_size, float(error))
+
+    holdout = select_spread_views(views, holdout_count, seed=attempts)
+    holdout_ids = {id(view) for view in holdout}
+    training = [view for view in views if id(view) not in holdout_ids]
+    subsets = [
+        _subset_args(select_spread_views(training, subset_size, seed=seed), image_size)
+        for seed in range(attempts)
+    ]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_calibrate_worker, subsets))
+
+    scored = [
+        (holdout_error(camera_matrix, dist_coeffs, holdout), error, camera_matrix, dist_coeffs)
+        for error, camera_matrix, dist_coeffs in results
+    ]
+    for attempt, (held_error, error, _, _) in enumerate(scored, 1):
+        print(f"Калибровка {attempt}/{len(scored)}: ошибка репроекции {error:.3f} px, "
+              f"на {len(holdout)} контрольных кадрах {held_error:.3f} px")
+    _, error, camera_matrix, dist_coeffs = min(scored, key=lambda result: result[0])
+    return CameraCalibration(camera_matrix, dist_coeffs, image_size, float(error))
+
+
+def collect_views_from_folder(folder: str, board_params, min_corners: int = 8, workers: Optional[int] = None):
+    """Поиск доски на всех изображениях каталога (в пуле процессов)"""
+    files = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))
+    )
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        views = [view for view in pool.map(_detect_file_worker, [(path, board_params, min_corners) for path in files]) if view]
+    print(f"Доска найдена на {len(views)} из {len(files)} изображений")
+    return views
+
+
+def collect_views_from_camera(board, max_views: int = 40, min_corners: int = 8,
+                              min_novelty: float = 0.08, timeout: float = 180.0, show: bool = True):
+    """Съемка доски камерой дрона: сохраняются только новые ракурсы"""
+    from pioneer_sdk import Camera
+
+    camera = Camera(timeout=2.0, port=8888, log_connection=True)
+    if not camera.connect():
+        raise Exception("Ошибка подключения к камере.")
+
+    views = []
+    deadline = time.time() + timeout
+    window_name = 'ChArUco Calibration'
+    try:
+        while len(views) < max_views and time.time() < deadline:
+            frame = camera.get_cv_frame()
+            if frame is None:
+                time.sleep(0.01)
+                continue
+            view = detect_charuco_view(frame, board, min_corners)
+            if view is not None:
+                novelty = min((np.linalg.norm(view.features - v.features) for v in views), default=np.inf)
+                if novelty >= min_novelty:
+                    views.append(view)
+                    print(f"Сохранен ракурс {len(views)}/{max_views}")
+            if show:
+                if view is not None:
+                    cv2.aruco.drawDetectedCornersCharuco(frame, view.image_points.reshape(-1, 1, 2).astype(np.float32))
+                cv2.putText(frame, f"Views: {len(views)}/{max_views}", (10, 25),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                cv2.imshow(window_name, frame)
+                if cv2.waitKey(1) == 27:
+                    break
+    finally:
+        if show:
+            cv2.destroyWindow(window_name)
+        camera.disconnect()
+    return views
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Калибровка камеры дрона по доске ChArUco")
+    parser.add_argument('--folder', help="каталог с записанными кадрами (иначе съемка камерой дрона)")
+    parser.add_argument('--drone-id', default=DRONE_ID, help="идентификатор дрона для имени файла")
+    parser.add_argument('--output', help="путь к файлу калибровки")
+    parser.add_argument('--squares', type=int, nargs=2, default=CHARUCO_SQUARES, metavar=('X', 'Y'))
+    parser.add_argument('--square-length', type=float, default=CHARUCO_SQUARE_LENGTH)
+    parser.add_argument('--marker-length', type=float, default=CHARUCO_MARKER_LENGTH)
+    parser.add_argument('--views', type=int, default=25, help="кадров в одной калибровке")
+    parser.add_argument('--attempts', type=int, default=4, help="число калибровок по разным подмножествам")
+    parser.add_argument('--workers', type=int, default=None, help="процессов в пуле")
+    args = parser.parse_args(argv)
+
+    board_params = (tuple(args.squares), args.square_length, args.marker_length, CHARUCO_DICTIONARY)
+    if args.folder:
+        views = collect_views_from_folder(args.folder, board_params, workers=args.workers)
+    else:
+        views = collect_views_from_camera(make_charuco_board(*board_params), max_views=args.views * 2, show=not HEADLESS)
+
+    calibration = calibrate_from_views(views, subset_size=args.views, attempts=args.attempts, workers=args.workers)
+    output = args.output or calibration_path(args.drone_id)
+    save_calibration(calibration, output)
+    print(f"✅ Калибровка сохранена в {output}, ошибка репроекции {calibration.reprojection_error:.3f} px")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,9 +10,41 @@ DATABASE_URL = os.getenv('DATABASE_URL', f'sqlite:///{os.path.join(BASE_DIR, "wa
 
 # Настройки камеры
 CAMERA_INDEX = 0
+# Идентификатор дрона: по нему выбираются файлы калибровки камеры
+DRONE_ID = os.getenv('DRONE_ID', 'pioneer_mini')
+CALIBRATION_DIR = os.path.join(BASE_DIR, 'calibration')
 FRAME_WIDTH = 640
 FRAME_HEIGHT = 480
 
 # Настройки сканирования
 SCAN_INTERVAL = 1
-QR_DETECTION_CONFIDENCE = 0.8 
\ No newline at end of file
+QR_DETECTION_CONFIDENCE = 0.8
+# Реализация детектора QR: opencv (cv2.QRCodeDetector) или opencv_aruco (cv2.QRCodeDetectorAruco).
+# Сравнить их на своих кадрах можно командой python qr_benchmark.py
+QR_BACKEND = os.getenv('QR_BACKEND', 'opencv')
+
+# Настройки отображения
+# HEADLESS=1 - работа без окна (наземная станция без дисплея).
+# Остановка сканирования - сигналом (SIGINT/SIGTERM) или созданием файла STOP_FILE
+HEADLESS = os.getenv('HEADLESS', '0') == '1'
+STOP_FILE = os.getenv('STOP_FILE', os.path.join(BASE_DIR, 'stop_scan.flag'))
+VIEWER_MAX_FPS = 15
+
+# Реакция на пропажу видеопотока дольше LINK_LOSS_LAND_AFTER секунд:
+# hover - зависать на месте до восстановления, land - завершить сканирование и сесть
+LINK_LOSS_POLICY = os.getenv('LINK_LOSS_POLICY', 'hover')
+LINK_LOSS_LAND_AFTER = float(os.getenv('LINK_LOSS_LAND_AFTER', '10'))
+
+# Замеры задержек по этапам цикла полета (FLIGHT_METRICS=1).
+# METRICS_PRINT_INTERVAL - период вывода строки статистики в секундах, 0 - только итог сессии
+FLIGHT_METRICS = os.getenv('FLIGHT_METRICS', '0') == '1'
+METRICS_PRINT_INTERVAL = float(os.getenv('METRICS_PRINT_INTERVAL', '0'))
+
+# Карта маркеров в локальной системе дрона: пополняется на каждой остановке у маркера.
+# MARKER_MAP=1 - следующие полеты летят к маркерам по карте напрямую (курс дрона счисляется
+# по командам поворота, поэтому перелеты по карте пока включаются явно)
+MARKER_MAP = os.getenv('MARKER_MAP', '0') == '1'
+MARKER_MAP_FILE = os.getenv('MARKER_MAP_FILE', os.path.join(BASE_DIR, 'marker_map.json'))
+# Знак yaw go_to_local_point относительно курса дрона (+ вправо): -1 - yaw против часовой
+# стрелки (правая система с осью z вверх), 1 - по часовой
+LOCAL_YAW_SIGN = float(os.getenv('LOCAL_YAW_SIGN', '-1'))
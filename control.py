@@ -0,0 +1,379 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from config import CALIBRATION_DIR, DRONE_ID
+
+
+class ControlEstimate(NamedTuple):
+    """Оценка положения цели от системы зрения для регулятора"""
+    timestamp: float     # время кадра по часам полета
+    marker_id: int
+    distance: float      # дистанция до маркера, м
+    x_center: float      # центр маркера в кадре, px
+    y_center: float
+    frame_width: int
+    frame_height: int
+
+
+class LatestValue:
+    """Слот последнего значения без блокировок.
+
+    Запись и чтение - это присваивание и чтение одной ссылки, которые в
+    CPython атомарны. Значение не изменяется после записи (кортеж), поэтому
+    читатель всегда видит целую оценку, а писатель никогда не ждет.
+    """
+
+    def __init__(self):
+        self._value = None
+
+    def write(self, value):
+        self._value = value
+
+    def read(self):
+        return self._value
+
+    def clear(self):
+        self._value = None
+
+
+class FixedRateController:
+    """Регулятор следования за маркером с фиксированной частотой.
+
+    Система зрения публикует оценки в estimate, регулятор с частотой rate_hz
+    берет последнюю и отправляет команду скорости, вычисленную command_fn.
+    Если оценка старше max_age секунд, дрон зависает на месте. В потоковом
+    режиме шаги выполняет отдельный поток; без потока (воспроизведение
+    записи) шаги выполняет poll() из цикла полета по часам clock.
+    """
+
+    def __init__(self, send_command: Callable[..., None],
+                 command_fn: Callable[[ControlEstimate], Tuple[float, float, float, float]],
+                 rate_hz: float = 10.0, max_age: float = 0.3, clock: Callable[[], float] = time.time,
+                 threaded: bool = True):
+        self.send_command = send_command
+        self.command_fn = command_fn
+        self.period = 1.0 / rate_hz
+        self.max_age = max_age
+        self.clock = clock
+        self.threaded = threaded
+        self.estimate = LatestValue()
+        self._lock = threading.Lock()  # исключает команду регулятора после disable()
+        self._enabled = False
+        self._running = False
+        self._thread = None
+        self._last_step: Optional[float] = None
+        self.commands = 0      # команд по оценке
+        self.stale_holds = 0   # шагов с зависанием из-за устаревшей оценки
+
+    def start(self):
+        if not self.threaded or self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="control")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0):
+        self.disable()
+        self._running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def enable(self):
+        self._enabled = True
+
+    def disable(self):
+        """Отключение регулятора; после возврата он больше не отправит команд"""
+        with self._lock:
+            self._enabled = False
+            self.estimate.clear()
+
+    def step(self):
+        with self._lock:
+            if not self._enabled:
+                return
+            estimate = self.estimate.read()
+            if estimate is None or self.clock() - estimate.timestamp > self.max_age:
+                self.stale_holds += 1
+                self.send_command(vx=0, vy=0, vz=0, yaw_rate=0)
+                return
+            v_x, v_y, v_z, yaw_rate = self.command_fn(estimate)
+            self.send_command(vx=v_x, vy=v_y, vz=v_z, yaw_rate=yaw_rate)
+            self.commands += 1
+
+    def poll(self):
+        """Шаг регулятора из цикла полета, если пришло время (режим без потока)"""
+        if self.threaded:
+            return
+        now = self.clock()
+        if self._last_step is None or now - self._last_step >= self.period:
+            self._last_step = now
+            self.step()
+
+    def _run(self):
+        next_step = time.monotonic()
+        while self._running:
+            try:
+                self.step()
+            except Exception as e:
+                print(f"Ошибка регулятора: {str(e)}")
+            next_step += self.period
+            delay = next_step - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Шаг не уложился в период - не пытаемся догонять
+                next_step = time.monotonic()
+
+
+def wait_until(predicate: Callable[[], bool], timeout: float, poll_interval: float = 0.05,
+               cancel: Optional[Callable[[], bool]] = None,
+               sleep: Callable[[float], None] = time.sleep, clock: Callable[[], float] = time.monotonic) -> bool:
+    """Ожидание условия с опросом, ограничением времени и отменой.
+
+    Между проверками поток спит poll_interval секунд, а не крутит цикл.
+    Возвращает True, если условие выполнилось, и False по истечении timeout
+    или если cancel() вернул True.
+    """
+    deadline = clock() + timeout
+    while True:
+        if predicate():
+            return True
+        if cancel is not None and cancel():
+            return False
+        remaining = deadline - clock()
+        if remaining <= 0:
+            return False
+        sleep(min(poll_interval, remaining))
+
+
+def heading_to_local_yaw(heading: float, sign: float = -1.0) -> float:
+    """Курс (градусы, + вправо) в yaw команды go_to_local_point (радианы).
+
+    Предполагается, что локальная система LPS правая с осью z вверх, тогда
+    yaw положителен против часовой стрелки (влево) и sign = -1. Курс вправо
+    совпадает по знаку с yaw_rate команд set_manual_speed_body_fixed, как в
+    исходном регуляторе подлета. Если перелеты по карте поворачивают не в ту
+    сторону, знак меняется через LOCAL_YAW_SIGN в config.py.
+    """
+    return float(sign * np.radians(heading))
+
+
+class CommandedHeading:
+    """Курс дрона, счисленный по командам скорости поворота.
+
+    Телеметрии курса нет, поэтому скорость поворота из команд
+    set_manual_speed_body_fixed (рад/с) интегрируется в предположении, что
+    каждая команда действует до следующей. Команда go_to_local_point с yaw
+    задает курс явно (set). Курс в градусах, положительный - вправо, ноль -
+    yaw=0 локальной системы. Команды приходят и из потока регулятора.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._heading = 0.0
+        self._rate = 0.0       # рад/с
+        self._since: Optional[float] = None
+        self.rotation_since_set = 0.0  # счисленный поворот с последнего set(), градусы
+
+    def _advance(self):
+        now = self.clock()
+        if self._since is not None and self._rate:
+            turn = float(np.degrees(self._rate)) * (now - self._since)
+            self._heading += turn
+            self.rotation_since_set += abs(turn)
+        self._since = now
+
+    def command(self, yaw_rate: float):
+        with self._lock:
+            self._advance()
+            self._rate = float(yaw_rate)
+
+    def set(self, heading: float):
+        with self._lock:
+            self._heading = float(heading)
+            self._rate = 0.0
+            self._since = self.clock()
+            self.rotation_since_set = 0.0
+
+    @property
+    def heading(self) -> float:
+        with self._lock:
+            self._advance()
+            return self._heading
+
+
+class PoseStabilityMonitor:
+    """Признак стабилизации дрона у маркера.
+
+    Дрон считается стабилизировавшимся, когда за последние window кадров
+    разброс (СКО) дистанции и положения центра маркера в кадре ниже порогов.
+    """
+
+    def __init__(self, window: int = 6, max_distance_std: float = 0.02, max_center_std: float = 5.0):
+        self.window = window
+        self.max_distance_std = max_distance_std  # м
+        self.max_center_std = max_center_std      # px
+        self._samples = deque(maxlen=window)
+
+    def reset(self):
+        self._samples.clear()
+
+    def add(self, distance: float, x_center: float, y_center: float):
+        self._samples.append((distance, x_center, y_center))
+
+    @property
+    def stable(self) -> bool:
+        if len(self._samples) < self.window:
+            return False
+        samples = np.array(self._samples)
+        distance_std, x_std, y_std = samples.std(axis=0)
+        return distance_std <= self.max_distance_std and max(x_std, y_std) <= self.max_center_std
+
+
+class PIDAxis:
+    """ПИД-регулятор одной оси с прямой связью и защитой от насыщения.
+
+    Прямая связь - постоянная добавка kff в сторону ошибки вне deadband:
+    она преодолевает зону нечувствительности дрона на малых скоростях.
+    Интеграл не накапливается, пока выход упирается в limit в сторону
+    ошибки, и сам ограничен integral_limit.
+    """
+
+    def __init__(self, kp: float, ki: float = 0.0, kd: float = 0.0, kff: float = 0.0,
+                 limit: float = 1.0, deadband: float = 0.0, integral_limit: Optional[float] = None):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.kff = kff
+        self.limit = limit
+        self.deadband = deadband
+        if integral_limit is None:
+            integral_limit = limit / ki if ki else 0.0
+        self.integral_limit = integral_limit
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.previous_error: Optional[float] = None
+
+    def update(self, error: float, dt: float) -> float:
+        derivative = 0.0
+        if self.previous_error is not None and dt > 0:
+            derivative = (error - self.previous_error) / dt
+        self.previous_error = error
+
+        feed_forward = self.kff * np.sign(error) if abs(error) > self.deadband else 0.0
+        integral = float(np.clip(self.integral + error * dt, -self.integral_limit, self.integral_limit))
+        output = self.kp * error + self.ki * integral + self.kd * derivative + feed_forward
+        if abs(output) <= self.limit or np.sign(output) != np.sign(error):
+            self.integral = integral
+        else:
+            # Насыщение: интеграл не растет, выход пересчитывается со старым интегралом
+            output = self.kp * error + self.ki * self.integral + self.kd * derivative + feed_forward
+        return float(np.clip(output, -self.limit, self.limit))
+
+
+# Коэффициенты регулятора подлета по умолчанию. Ошибки по осям x и y кадра
+# нормированы на половину ширины и высоты кадра, ошибка дистанции - в метрах
+DEFAULT_GAIN_PROFILE = {
+    'lateral': {'kp': 0.25, 'ki': 0.05, 'kd': 0.03, 'kff': 0.0},
+    'forward': {'kp': 0.25, 'ki': 0.02, 'kd': 0.05, 'kff': 0.05},
+    'vertical': {'kp': 0.15, 'ki': 0.03, 'kd': 0.02, 'kff': 0.0},
+    'yaw': {'kp': 0.15, 'ki': 0.0, 'kd': 0.02, 'kff': 0.0},
+}
+
+
+def gain_profile_path(drone_id: str = DRONE_ID) -> str:
+    """Путь к файлу коэффициентов регулятора дрона"""
+    return os.path.join(CALIBRATION_DIR, f"{drone_id}_control.json")
+
+
+def load_gain_profile(drone_id: str = DRONE_ID) -> Dict[str, Dict[str, float]]:
+    """Коэффициенты регулятора дрона: значения из файла поверх значений по умолчанию"""
+    profile = {axis: dict(gains) for axis, gains in DEFAULT_GAIN_PROFILE.items()}
+    path = gain_profile_path(drone_id)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for axis, gains in json.load(f).items():
+                if axis not in profile:
+                    raise ValueError(f"Неизвестная ось регулятора в {path}: {axis}")
+                profile[axis].update(gains)
+        print(f"✅ Загружены коэффициенты регулятора: {path}")
+    return profile
+
+
+class MarkerApproachController:
+    """Регулятор подлета к маркеру по четырем осям.
+
+    lateral (vx) и yaw - по смещению маркера по горизонтали, vertical (vz) -
+    по вертикали, forward (vy) - по ошибке дистанции. Вперед дрон движется
+    тем медленнее, чем дальше маркер от центра кадра, и не движется, если
+    смещение больше четверти ширины кадра. Выход обновляется только по
+    новой оценке; при смене маркера или перерыве в оценках регулятор
+    сбрасывается.
+    """
+
+    def __init__(self, speed_settings: Dict, gain_profile: Dict[str, Dict[str, float]], max_gap: float = 0.5):
+        self.target_distance = speed_settings['target_distance']
+        self.max_gap = max_gap
+        self.axes = {
+            'lateral': PIDAxis(limit=speed_settings['centering_speed'], **gain_profile['lateral']),
+            'forward': PIDAxis(limit=speed_settings['max_speed'], deadband=speed_settings['distance_threshold'],
+                               **gain_profile['forward']),
+            'vertical': PIDAxis(limit=speed_settings['vertical_speed'], **gain_profile['vertical']),
+            'yaw': PIDAxis(limit=speed_settings['yaw_speed'], **gain_profile['yaw']),
+        }
+        self.marker_id = None
+        self._last_timestamp: Optional[float] = None
+        self._last_command = (0.0, 0.0, 0.0, 0.0)
+
+    def reset(self):
+        for axis in self.axes.values():
+            axis.reset()
+        self.marker_id = None
+        self._last_timestamp = None
+        self._last_command = (0.0, 0.0, 0.0, 0.0)
+
+    def command(self, estimate: ControlEstimate) -> Tuple[float, float, float, float]:
+        """(vx, vy, vz, yaw_rate) по оценке положения маркера"""
+        if estimate.timestamp == self._last_timestamp:
+            return self._last_command
+        if (estimate.marker_id != self.marker_id or self._last_timestamp is None
+                or estimate.timestamp - self._last_timestamp > self.max_gap):
+            self.reset()
+            self.marker_id = estimate.marker_id
+            dt = 0.0
+        else:
+            dt = estimate.timestamp - self._last_timestamp
+        self._last_timestamp = estimate.timestamp
+
+        x_error = (estimate.x_center - estimate.frame_width / 2) / (estimate.frame_width / 2)
+        y_error = (estimate.y_center - estimate.frame_height / 2) / (estimate.frame_height / 2)
+        distance_error = estimate.distance - self.target_distance
+
+        v_x = self.axes['lateral'].update(x_error, dt)
+        yaw_rate = self.axes['yaw'].update(x_error, dt)
+        v_z = self.axes['vertical'].update(-y_error, dt)
+        forward_scale = float(np.clip(1.0 - abs(x_error) / 0.5, 0.0, 1.0))
+        if forward_scale > 0:
+            v_y = self.axes['forward'].update(distance_error, dt) * forward_scale
+        else:
+            # Пока маркер далеко от центра, ошибка дистанции не накапливается
+            self.axes['forward'].reset()
+            v_y = 0.0
+
+        self._last_command = (v_x, v_y, v_z, yaw_rate)
+        return self._last_command
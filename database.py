@@ -1,9 +1,10 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Boolean, ForeignKey, func
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Boolean, ForeignKey, Text, func, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 from typing import Optional, Union, List
 from config import DATABASE_URL
+import json
 import uuid
 import os
 
@@ -20,6 +21,7 @@ class ScanSession(Base):
     start_time = Column(DateTime, default=datetime.utcnow)
     end_time = Column(DateTime, nullable=True)
     status = Column(String, default='active')
+    results = Column(Text, nullable=True)  # итоговый отчет сессии (JSON)
     
     scan_history = relationship("ScanHistory", back_populates="session")
 
@@ -85,9 +87,18 @@ def init_db(check_existing=False):
         print("Созданы новые таблицы базы данных")
     else:
         print("Используется существующая база данных")
+        _migrate_db(engine)
         
     return True
 
+def _migrate_db(engine):
+    """Добавление новых столбцов в существующую базу данных"""
+    columns = {column['name'] for column in inspect(engine).get_columns('scan_sessions')}
+    if 'results' not in columns:
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE scan_sessions ADD COLUMN results TEXT"))
+        print("Добавлен столбец results в таблицу scan_sessions")
+
 def clean_string(s: str) -> str:
     return ' '.join(s.split())
 
@@ -187,6 +198,8 @@ def end_scan_session(session_uuid: str, status: str = "completed", results: Opti
         if scan_session:
             scan_session.status = status
             scan_session.end_time = datetime.utcnow()
+            if results is not None:
+                scan_session.results = json.dumps(results, ensure_ascii=False, default=str)
             session.commit()
             return True
     finally:
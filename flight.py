@@ -5,6 +5,20 @@ import signal
 import sys
 import time
 from database import add_item, add_scan_history, init_db, Item, find_item, end_scan_session
+from config import (HEADLESS, STOP_FILE, VIEWER_MAX_FPS, FLIGHT_METRICS, METRICS_PRINT_INTERVAL, QR_BACKEND,
+                    LINK_LOSS_POLICY, LINK_LOSS_LAND_AFTER, MARKER_MAP, MARKER_MAP_FILE, LOCAL_YAW_SIGN)
+from frame_source import LatestFrameGrabber
+from frame_preprocessing import FramePreprocessor
+from calibration import CameraCalibration, calibration_path, load_calibration
+from qr_decoding import QRDecodeCascade, QRVoteAggregator, SharpnessGate, create_qr_detector, marker_guided_roi
+from qr_pool import QRDecodePool
+from marker_detection import PyramidArucoDetector, FrameMarkers, MarkerTracker
+from pose_estimation import BoardPoseEstimator, MarkerPoseEstimator, distance_from_size
+from overlay import OverlayViewer
+from control import (CommandedHeading, ControlEstimate, FixedRateController, MarkerApproachController, PoseStabilityMonitor,
+                     heading_to_local_yaw, load_gain_profile, wait_until)
+from flight_metrics import FlightMetrics
+from marker_map import MarkerMap, camera_to_local, camera_to_local_direction
 from typing import Optional, cast, Dict, Tuple
 import asyncio
 import os
@@ -35,6 +49,14 @@ LOCATION_TO_ARUCO = {
     for shelf, position in set((s, p) for s, p in ARUCO_LOCATIONS.values())
 }
 
+# Доски полок: несколько маркеров одной полки с известным взаимным расположением.
+# Ключ - (стеллаж, полка) из ARUCO_LOCATIONS, значение - {ID маркера: (x, y) центра, м},
+# x - вправо, y - вверх в плоскости полки. Для таких полок поза считается
+# совместно по всем видимым маркерам, а блокировка действует на всю полку
+SHELF_BOARDS: Dict[Tuple[str, str], Dict[int, Tuple[float, float]]] = {
+    # ("1", "2"): {0: (0.0, 0.0), 2: (0.5, 0.0)},
+}
+
 telegram_thread = None
 should_stop = False
 
@@ -52,11 +74,23 @@ class ArucoFlight:
     def __init__(self, chat_id: Optional[str] = None, session_uuid: Optional[str] = None):
         self.mini = None
         self.camera = None
+        self.frame_grabber = None
         self.telegram_initialized = False
         self.chat_id = chat_id
         self.session_uuid = session_uuid
         self.size_of_marker = 0.1
         self.is_flying = False
+        # Источник времени цикла полета (при воспроизведении записи - время кадров)
+        self.clock = time.time
+        self.sleep = time.sleep
+        self.headless = HEADLESS  # без окна: остановка сигналом или файлом STOP_FILE
+        self.viewer = None
+        self.controller = None
+        self.stop_file = STOP_FILE  # None - файл остановки не проверяется (воспроизведение записи)
+        self._last_stop_check = 0.0
+        self._stop_flag = False
+        # Задержки этапов цикла: frame_wait, frame_age, preprocess, aruco, pose, sharpness, qr, db, gui
+        self.metrics = FlightMetrics(enabled=FLIGHT_METRICS, print_interval=METRICS_PRINT_INTERVAL)
         self.retreat_mode = False
         self.retreat_start_time = None
         self.target_reached = False
@@ -64,12 +98,15 @@ class ArucoFlight:
         # Добавляем настройки управления
         self.speed_settings = {
             'max_speed': 0.18,      # максимальная скорость движения
-            'min_speed': 0.1,      # минимальная скорость движения
             'target_distance': 1.35, # максимальная дистанция до маркера
             'distance_threshold': 0.05, # допустимое отклонение от желаемой дистанции
             'yaw_speed': 0.1,      # скорость поворота
-            'control_delay': 0.8,   # задержка между командами управления
-            'stabilization_time': 4.0, # время стабилизации после достижения цели
+            'control_delay': 0.8,   # задержка между командами поиска и отлета
+            'stabilization_time': 4.0, # наибольшее время стабилизации после достижения цели
+            'stabilization_window': 6,        # кадров для оценки разброса положения
+            'stabilization_distance_std': 0.02, # допустимый разброс дистанции, м
+            'stabilization_center_std': 5.0,  # допустимый разброс центра маркера, px
+            'point_timeout': 15.0,    # ожидание прилета в точку, с
             'vertical_speed': 0.09, # скорость вертикального движения
             'centering_speed': 0.12,  # увеличиваем скорость бокового движения
             'center_threshold': 70,   # увеличиваем зону для первичного центрирования
@@ -78,8 +115,8 @@ class ArucoFlight:
             'qr_center_threshold': 50,     # порог для центрирования по QR
             'qr_scan_threshold': 60,       # порог для сканирования QR
             'retreat_speed': 0.2,  # единая скорость отлета
-            'retreat_distance': 0.8, # единая дистанция отлета
-            'retreat_time': 3,   # время отлета (в секундах)
+            'retreat_distance': 0.8, # дистанция отлета от последнего положения у маркера, м
+            'retreat_timeout': 6.0,  # наибольшее время отлета, с
             'max_height': 0.6,     # максимальная высота подъема
             'min_height': 0.4,     # минимальная высота
             'search_speed': 0.05,   # скорость поиска
@@ -88,22 +125,105 @@ class ArucoFlight:
             'qr_display_time': 3.0,  # время отображения сообщений о QR
             'search_yaw_speed': 0.2,  # скорость поворота при поиске
             'max_search_yaw': 45,     # максимальный угол поворота в градусах
+            'search_memory_time': 30.0,  # сколько помнить направление на неотсканированный маркер, с
+            'control_thread': True,   # регулятор следования за маркером в отдельном потоке
+            'control_rate': 10.0,     # частота команд регулятора, Гц
+            'max_estimate_age': 0.3,  # оценка старше (с) - зависание на месте
+            'map_navigation': MARKER_MAP,  # перелет к маркерам по карте вместо поиска поворотом
+            'map_max_heading_rotation': 90.0,  # счисленный поворот (градусы) с последнего заданного курса,
+                                               # после которого наблюдения в карту не записываются
+        }
+        # Сторожевой таймер видеопотока
+        self.watchdog_settings = {
+            'frame_timeout': 0.25,    # ожидание кадра в цикле полета, с
+            'hover_after': 0.5,       # без кадров дольше (с) - зависание на месте
+            'land_after': LINK_LOSS_LAND_AFTER,  # без кадров дольше (с) - посадка при policy='land'
+            'policy': LINK_LOSS_POLICY,  # 'hover' или 'land'
+            'hover_repeat': 1.0,      # период повтора команды зависания, с
         }
-        self.points_of_marker = np.array(
-            [
-                (self.size_of_marker / 2, -self.size_of_marker / 2, 0),
-                (-self.size_of_marker / 2, -self.size_of_marker / 2, 0),
-                (-self.size_of_marker / 2, self.size_of_marker / 2, 0),
-                (self.size_of_marker / 2, self.size_of_marker / 2, 0),
-            ]
+        self._last_frame_clock = 0.0
+        self._last_hover_command = None
+        self._link_lost = False
+        # Настройки обработки изображения
+        self.vision_settings = {
+            'qr_variants': ['raw', 'blur5', 'blur7'],  # порядок предобработки для QR
+            'qr_min_size': 0,         # минимальный размер QR (px) для уверенного декодирования
+            # Область поиска QR относительно маркера (в сторонах маркера, y - вниз).
+            # Ключ - ID маркера ArUco, 'default' - для остальных маркеров
+            'qr_roi_layouts': {
+                'default': {'offset': (0.0, -2.0), 'size': (4.0, 3.0)},
+            },
+            'qr_roi_max_misses': 10,  # промахов в области до перехода на весь кадр
+            'aruco_pyramid': True,    # поиск ArUco на уменьшенном кадре с уточнением углов
+            'aruco_min_marker_side': 48,  # сторона маркера (px) на уменьшенном кадре
+            'aruco_min_scale': 0.25,  # минимальный масштаб уменьшения кадра
+            'marker_tracking': True,  # сопровождение заблокированного маркера оптическим потоком
+            'tracking_redetect_interval': 5,  # полная детекция раз в N кадров сопровождения
+            'tracking_min_confidence': 0.6,   # порог уверенности сопровождения
+            'qr_multi_decode': False, # чтение всех QR-кодов полки за одну остановку
+            'qr_multi_settle_frames': 5,  # кадров без новых QR перед отлетом
+            'qr_pool': False,         # декодирование QR в пуле процессов (по процессу на вариант)
+            'qr_pool_deadline': 0.25, # время (с) на декодирование одного кадра в пуле
+            'qr_blur_gate': True,     # пропуск смазанных кадров перед декодированием QR
+            'qr_blur_ratio': 0.6,     # доля от резкости лучших недавних кадров
+            'qr_blur_window': 30,     # кадров в окне адаптивного порога
+            'qr_vote_window': 8,      # последних чтений одного QR в голосовании
+            'qr_vote_min_votes': 3,   # голосов, чтобы принять содержимое QR
+            'qr_vote_min_share': 0.6, # доля голосов за содержимое в окне
+            'pose_max_jump': 0.15,    # смещение маркера (м), после которого поза решается заново
+            'coarse_pose_distance': 2.5,  # дальше (м) - дистанция только по видимому размеру маркера
+            'shelf_boards': True,     # совместная поза и блокировка по полке для SHELF_BOARDS
+        }
+        self.pose_estimator = MarkerPoseEstimator(
+            self.size_of_marker,
+            max_jump=self.vision_settings['pose_max_jump'],
+            clock=lambda: self.clock()  # часы полета; при воспроизведении подменяются после создания
         )
+        self.board_pose_estimator = BoardPoseEstimator(SHELF_BOARDS, self.size_of_marker, clock=lambda: self.clock())
         self.aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
         self.aruco_params = cv2.aruco.DetectorParameters()
         self.aruco_detector = cv2.aruco.ArucoDetector(self.aruco_dict, self.aruco_params)
+        self.pyramid_detector = PyramidArucoDetector(
+            self.aruco_detector,
+            min_marker_side=self.vision_settings['aruco_min_marker_side'],
+            min_scale=self.vision_settings['aruco_min_scale']
+        )
+        self.marker_tracker = MarkerTracker(
+            redetect_interval=self.vision_settings['tracking_redetect_interval'],
+            min_confidence=self.vision_settings['tracking_min_confidence'],
+            min_shape_confidence=self.speed_settings['aruco_confidence_threshold']
+        )
+        self.calibration = None
         self.camera_matrix = None
         self.dist_coeffs = None
-        self.qr_detector = cv2.QRCodeDetector()
+        self.frame_size = None
+        self.qr_detector = create_qr_detector(QR_BACKEND)
+        self.qr_cascade = QRDecodeCascade(
+            self.qr_detector,
+            variants=self.vision_settings['qr_variants'],
+            min_qr_size=self.vision_settings['qr_min_size']
+        )
         self.best_result = None
+        self.preprocessor = FramePreprocessor()
+        self.sharpness_gate = SharpnessGate(
+            ratio=self.vision_settings['qr_blur_ratio'],
+            window=self.vision_settings['qr_blur_window']
+        )
+        self.qr_votes = QRVoteAggregator(
+            window=self.vision_settings['qr_vote_window'],
+            min_votes=self.vision_settings['qr_vote_min_votes'],
+            min_share=self.vision_settings['qr_vote_min_share']
+        )
+        self.qr_pool = None
+        self.qr_roi_corners = None  # углы маркера, по которым строится область поиска QR
+        self.qr_roi_misses = 0
+        self.approach_controller = MarkerApproachController(self.speed_settings, load_gain_profile())
+        self.approach = None  # текущий подлет: маркер, время начала, счетчик команд
+        self.pose_stability = PoseStabilityMonitor(
+            window=self.speed_settings['stabilization_window'],
+            max_distance_std=self.speed_settings['stabilization_distance_std'],
+            max_center_std=self.speed_settings['stabilization_center_std']
+        )
         self.scanned_markers = set()
         self.scanned_qr_codes = set()
         self.window_name = 'Drone Camera Feed'
@@ -116,6 +236,12 @@ class ArucoFlight:
         self.search_yaw_direction = 1  # 1 - вправо, -1 - влево
         self.current_yaw = 0  # текущий угол поворота
         self.current_aruco_id = None  # Добавляем отслеживание текущего ArUco ID
+        self.last_marker_pose = None  # (ID, дистанция) последнего найденного положения маркера
+        self.retreat = None  # начало текущего отлета: маркер, дистанция, положение дрона
+        self.marker_sightings = {}  # ID неотсканированного маркера -> (курс на маркер, градусы; время)
+        self.heading = CommandedHeading(clock=lambda: self.clock())  # курс, счисленный по командам
+        self.marker_map = MarkerMap.load(MARKER_MAP_FILE)
+        self.navigated_markers = set()  # маркеры, к которым уже летали по карте в этом полете
         
         # Добавляем параметры для отслеживания высоты
         self.initial_height = None  # Начальная высота
@@ -135,7 +261,18 @@ class ArucoFlight:
             'end_time': None,         # время окончания сканирования
             'total_attempts': 0,      # общее количество попыток сканирования
             'successful_scans': 0,    # успешные сканирования
-            'errors': []              # ошибки во время сканирования
+            'errors': [],             # ошибки во время сканирования
+            'processed_frames': 0,    # обработано кадров
+            'dropped_frames': 0,      # пропущено устаревших кадров
+            'detected_frames': 0,     # кадров с полной детекцией ArUco
+            'tracked_frames': 0,      # кадров с сопровождением маркера без детекции
+            'qr_gated_frames': 0,     # смазанных кадров, пропущенных без декодирования QR
+            'qr_decoded_frames': 0,   # кадров, переданных на декодирование QR
+            'link_outages': 0,        # пропаж видеопотока с зависанием
+            'frame_gaps': 0,          # разрывов видеопотока
+            'longest_frame_gap': 0.0, # самый длинный разрыв, с
+            'camera_reconnects': 0,   # переподключений камеры
+            'approaches': []          # подлеты к маркерам: время до цели и число команд
         }
         
         # Добавляем настройки для поиска по yaw
@@ -145,7 +282,7 @@ class ArucoFlight:
             'direction': 1,
             'min_angle': -45,  # минимальный угол поворота
             'max_angle': 45,   # максимальный угол поворота
-            'step_rate': 15    # скорость изменения угла (градусов в секунду)
+            'start_heading': 0.0  # счисленный курс в начале поворота, градусы
         }
 
     def initialize(self):
@@ -154,6 +291,16 @@ class ArucoFlight:
             print("Инициализация системы...")
             init_db()
             
+            # Процессы декодирования запускаются до потоков камеры и Telegram
+            if self.vision_settings['qr_pool']:
+                self.qr_pool = QRDecodePool(
+                    self.vision_settings['qr_variants'],
+                    deadline=self.vision_settings['qr_pool_deadline'],
+                    min_qr_size=self.vision_settings['qr_min_size'],
+                    backend=QR_BACKEND
+                )
+                self.qr_pool.start()
+            
             if self.chat_id:
                 try:
                     self.telegram_initialized = True
@@ -202,26 +349,54 @@ class ArucoFlight:
         if not self.camera.connect():
             raise Exception("Ошибка подключения к камере.")
         print("Камера дрона подключена успешно!")
+
+        # Камерой владеет поток захвата, цикл полета берет из него свежий кадр
+        self.frame_grabber = LatestFrameGrabber(self.camera)
+        self.frame_grabber.start()
         
     def _load_camera_calibration(self):
         """Загрузка калибровочных данных камеры"""
         try:
-            self.camera_matrix = np.array([
-                [921.170702, 0.000000, 459.904354],
-                [0.000000, 919.018377, 351.238301],
-                [0.000000, 0.000000, 1.000000]
-            ], dtype=np.float32)
-            
-            self.dist_coeffs = np.array([
-                [0.000000, 0.000000, 0.000000, 0.000000, 0.000000]
-            ], dtype=np.float32)
+            path = calibration_path()
+            if os.path.exists(path):
+                self.calibration = load_calibration(path)
+                print(f"✅ Загружены калибровочные данные камеры: {path}")
+                if self.calibration.reprojection_error is not None:
+                    print(f"Ошибка репроекции калибровки: {self.calibration.reprojection_error:.3f} px")
+            else:
+                self.calibration = CameraCalibration(
+                    [
+                        [921.170702, 0.000000, 459.904354],
+                        [0.000000, 919.018377, 351.238301],
+                        [0.000000, 0.000000, 1.000000]
+                    ],
+                    [0.000000, 0.000000, 0.000000, 0.000000, 0.000000]
+                )
+                print(f"⚠️ Файл калибровки {path} не найден, используются примерные калибровочные данные")
             
-            print("✅ Используются примерные калибровочные данные")
+            self.camera_matrix = self.calibration.camera_matrix.astype(np.float32)
+            self.dist_coeffs = self.calibration.dist_coeffs.astype(np.float32)
+            self.frame_size = None
             
         except Exception as e:
             print(f"❌ Ошибка при установке калибровочных данных: {str(e)}")
             raise
 
+    def _update_frame_size(self, frame):
+        """Подготовка калибровки под размер кадра (один раз на разрешение)"""
+        frame_size = (frame.shape[1], frame.shape[0])
+        if frame_size == self.frame_size:
+            return
+        self.frame_size = frame_size
+        self.camera_matrix = self.calibration.matrix_for_size(frame_size).astype(np.float32)
+        if self.calibration.has_distortion:
+            self.preprocessor.set_undistort_maps(
+                self.calibration.undistort_maps(frame_size),
+                self.calibration.matrix_for_size(frame_size), self.calibration.dist_coeffs
+            )
+        else:
+            self.preprocessor.set_undistort_maps(None)
+
     def safe_landing(self, signum=None, frame=None):
         """Безопасная посадка дрона"""
         try:
@@ -229,13 +404,15 @@ class ArucoFlight:
             if self.telegram_initialized:
                 telegram_queue.put("⚠️ Процесс сканирования прерван. Возвращаюсь на точку взлета...")
             
+            if self.controller is not None:
+                self.controller.stop()
+
             if self.is_flying and self.mini:
                 try:
                     print("Возвращаюсь на точку взлета...")
-                    self.mini.go_to_local_point(x=0, y=0, z=0.8, yaw=0)
-                    timeout = time.time() + 10
-                    while not self.mini.point_reached() and time.time() < timeout:
-                        time.sleep(0.1)
+                    self._go_to_local_point(x=0, y=0, z=0.8)
+                    if not wait_until(self.mini.point_reached, timeout=10, poll_interval=0.1):
+                        print("⚠️ Точка взлета не достигнута за 10 с")
                 except Exception as e:
                     print(f"Ошибка при возврате на точку взлета: {str(e)}")
                 
@@ -246,6 +423,13 @@ class ArucoFlight:
             
             if self.mini:
                 self.mini.close_connection()
+
+            if self.frame_grabber:
+                self.frame_grabber.stop()
+
+            if self.qr_pool:
+                self.qr_pool.close()
+                self.qr_pool = None
                 
         except Exception as e:
             print(f"Ошибка при посадке: {str(e)}")
@@ -258,78 +442,384 @@ class ArucoFlight:
                         telegram_queue.put("✅ Сессия сканирования завершена")
             except Exception as e:
                 print(f"Ошибка при завершении сессии: {str(e)}")
-            cv2.destroyAllWindows()
+            if not self.headless:
+                cv2.destroyAllWindows()
             sys.exit(0)
 
-    def calculate_control_speed(self, distance, x_center, y_center, frame_height, frame_width):
-        """Расчет скорости движения на основе дистанции и положения маркера"""
-        x_center_error = x_center - frame_width/2
-        y_center_error = y_center - frame_height/2
-        distance_error = distance - self.speed_settings['target_distance']
-        
-        v_x = 0
-        v_y = 0
-        v_z = 0
-        yaw_rate = 0
-        
-        is_centered_x = abs(x_center_error) < self.speed_settings['center_threshold']
-        is_at_distance = abs(distance_error) < self.speed_settings['distance_threshold']
+    def _stop_requested(self):
+        """Проверка запроса остановки: ESC/закрытие окна или файл STOP_FILE"""
+        if self._stop_flag:
+            return True
+        if self.viewer is not None and self.viewer.stop_requested:
+            return True
+        if self.stop_file is None:
+            return False
+        now = time.monotonic()
+        if now - self._last_stop_check < 0.5:
+            return False
+        self._last_stop_check = now
+        if os.path.exists(self.stop_file):
+            print(f"Найден файл остановки {self.stop_file}, завершаю сканирование")
+            os.remove(self.stop_file)
+            self._stop_flag = True
+            return True
+        return False
+
+    def _send_speed(self, vx, vy, vz, yaw_rate):
+        """Команда скорости дрону с учетом поворота в счислении курса"""
+        self.heading.command(yaw_rate)
+        self.mini.set_manual_speed_body_fixed(vx=vx, vy=vy, vz=vz, yaw_rate=yaw_rate)
+
+    def _go_to_local_point(self, x, y, z, yaw=0.0):
+        """Перелет в точку локальной системы; yaw - курс в градусах (+ вправо)"""
+        self.mini.go_to_local_point(x=x, y=y, z=z, yaw=heading_to_local_yaw(yaw, LOCAL_YAW_SIGN))
+        self.heading.set(yaw)
+
+    def _manual_speed(self, vx, vy, vz, yaw_rate):
+        """Команда скорости из цикла полета; регулятор следования при этом отключается"""
+        if self.controller is not None:
+            self.controller.disable()
+        self._send_speed(vx=vx, vy=vy, vz=vz, yaw_rate=yaw_rate)
+
+    def marker_control_command(self, estimate):
+        """Команда скорости по оценке положения маркера: (vx, vy, vz, yaw_rate)"""
+        return self.approach_controller.command(estimate)
+
+    def _finish_approach(self, marker_id):
+        """Запись времени подлета к маркеру и числа команд регулятора"""
+        if self.approach is None or self.approach['marker_id'] != marker_id:
+            return
+        record = {
+            'marker_id': int(marker_id),
+            'time_to_target': round(self.clock() - self.approach['start'], 2),
+            'commands': self.controller.commands - self.approach['commands'],
+        }
+        self.scan_results['approaches'].append(record)
+        self.approach = None
+        print(f"Подлет к маркеру {record['marker_id']}: {record['time_to_target']:.1f} с, команд {record['commands']}")
+
+    def _local_position(self):
+        """Положение дрона в локальной системе координат (x, y, z) или None"""
+        try:
+            position = self.mini.get_local_position_lps(get_last_received=True)
+        except Exception as e:
+            print(f"Ошибка при получении положения дрона: {str(e)}")
+            return None
+        return None if position is None else np.array(position[:3], dtype=np.float64)
+
+    def _begin_retreat(self):
+        """Начало отлета: запоминаем последнее положение маркера и дрона"""
+        marker_id, distance = self.last_marker_pose if self.last_marker_pose else (None, None)
+        # Поток регулятора останавливаем до запроса телеметрии по тому же соединению
+        if self.controller is not None:
+            self.controller.disable()
+        self.retreat = {
+            'marker_id': marker_id,
+            'distance': distance,
+            'position': self._local_position(),
+            'start': self.clock(),
+        }
+        self._manual_speed(vx=0, vy=-self.speed_settings['retreat_speed'], vz=0, yaw_rate=0)
+
+    def _retreat_progress(self, frame_markers):
+        """Пройденное при отлете расстояние, м, и источник оценки.
+
+        Если маркер, от которого начат отлет, виден - по его дистанции,
+        иначе по одометрии дрона, а без нее - по скорости и времени отлета.
+        """
+        retreat = self.retreat
+        if frame_markers is not None and retreat['distance'] is not None:
+            i = frame_markers.index_of(retreat['marker_id'], range(len(frame_markers)))
+            distance = frame_markers.distance(i) if i is not None else None
+            if distance is not None:
+                return distance - retreat['distance'], 'маркер'
+        if retreat['position'] is not None:
+            position = self._local_position()
+            if position is not None:
+                return float(np.linalg.norm(position[:2] - retreat['position'][:2])), 'одометрия'
+        return self.speed_settings['retreat_speed'] * (self.clock() - retreat['start']), 'время'
+
+    def _note_marker_bearings(self, frame_markers, indices):
+        """Запоминаем курс на видимые неотсканированные маркеры (направление в кадре плюс курс дрона)"""
+        fx, cx = self.camera_matrix[0, 0], self.camera_matrix[0, 2]
+        now = self.clock()
+        heading = self.heading.heading
+        for i in indices:
+            marker_id = int(frame_markers.ids[i])
+            if marker_id in self.scanned_markers:
+                continue
+            bearing = float(np.degrees(np.arctan2(frame_markers.centers[i][0] - cx, fx)))
+            self.marker_sightings[marker_id] = (heading + bearing, now)
+
+    def _unscanned_marker_bearing(self):
+        """Направление от текущего курса (градусы, + вправо) на последний замеченный неотсканированный маркер или None"""
+        now = self.clock()
+        heading = self.heading.heading
+        sightings = []
+        for marker_id, (marker_heading, seen) in self.marker_sightings.items():
+            if marker_id in self.scanned_markers or now - seen > self.speed_settings['search_memory_time']:
+                continue
+            # Поворот между замечанием маркера и началом поиска вычитается
+            bearing = (marker_heading - heading + 180.0) % 360.0 - 180.0
+            sightings.append((seen, -abs(bearing), bearing))
+        return max(sightings)[2] if sightings else None
 
-        if abs(x_center_error) > frame_width/4:
-            yaw_rate = self.speed_settings['yaw_speed'] * np.sign(x_center_error)
-            v_x = self.speed_settings['centering_speed'] * np.sign(x_center_error)
+    def _start_yaw_search(self):
+        """Поворот для поиска маркеров: сначала в сторону последних неотсканированных"""
+        bearing = self._unscanned_marker_bearing()
+        max_angle = self.speed_settings['max_search_yaw']
+        direction = 1
+        if bearing is not None:
+            direction = 1 if bearing >= 0 else -1
+            max_angle = max(max_angle, abs(bearing))
+            print(f"Начинаю поворот к неотсканированным маркерам (направление {bearing:+.1f}°)")
         else:
-            x_error_ratio = abs(x_center_error) / (frame_width/4)
-            
-            yaw_rate = self.speed_settings['yaw_speed'] * x_error_ratio * np.sign(x_center_error)
-            
-            v_x = max(self.speed_settings['centering_speed'] * 0.5,
-                     self.speed_settings['centering_speed'] * x_error_ratio) * np.sign(x_center_error)
-            
-            if abs(v_x) > self.speed_settings['centering_speed'] * 0.5:
-                yaw_rate *= 0.5
+            print("Неотсканированные маркеры не замечены, начинаю поворот для поиска")
+        self.yaw_search = {
+            'active': True,
+            'current_angle': 0,
+            'direction': direction,
+            'min_angle': -max_angle,
+            'max_angle': max_angle,
+            'start_heading': self.heading.heading
+        }
 
-        if abs(y_center_error) > self.speed_settings['center_threshold']:
-            v_z = -self.speed_settings['vertical_speed'] * np.sign(y_center_error)
-            
-        if is_centered_x:
-            if not is_at_distance:
-                distance_ratio = abs(distance_error) / self.speed_settings['target_distance']
-                v_y = self.speed_settings['max_speed'] * distance_ratio * np.sign(distance_error)
-                
-                if abs(v_y) < self.speed_settings['min_speed']:
-                    v_y = self.speed_settings['min_speed'] * np.sign(distance_error)
-                
-                if abs(distance_error) < 0.2:
-                    v_y *= 0.4
+    def _update_marker_map(self, frame_markers, marker_idx):
+        """Наблюдение маркера на остановке в карту: положение и курс дрона, поза маркера.
+
+        Курс счисляется по командам поворота; если с последнего заданного
+        курса дрон повернулся слишком много, ошибка счисления велика и
+        наблюдение пропускается.
+        """
+        pose = frame_markers.pose(marker_idx)
+        if pose is None or pose[1] is None:
+            return
+        if self.heading.rotation_since_set > self.speed_settings['map_max_heading_rotation']:
+            print(f"Курс не уточнялся после поворота на {self.heading.rotation_since_set:.0f}°, "
+                  f"маркер в карту не записан")
+            return
+        position = self._local_position()
+        if position is None:
+            return
+        rvec, tvec, _ = pose
+        heading = self.heading.heading
+        rotation, _ = cv2.Rodrigues(rvec)
+        # Ось z маркера направлена из его плоскости к камере
+        normal = camera_to_local_direction(rotation[:, 2], heading)
+        marker_id = int(frame_markers.ids[marker_idx])
+        result = self.marker_map.add_observation(marker_id, camera_to_local(position, tvec, heading), normal)
+        if result == 'new':
+            print(f"Маркер {marker_id} добавлен в карту")
+        try:
+            self.marker_map.save()
+        except Exception as e:
+            print(f"Ошибка при сохранении карты маркеров: {str(e)}")
+
+    def _fly_to_mapped_marker(self):
+        """Перелет по карте к точке подлета ближайшего неотсканированного маркера.
+
+        Возвращает ID маркера или None, если таких маркеров на карте нет.
+        Окончательное центрирование выполняет регулятор подлета по изображению.
+        """
+        if not self.speed_settings['map_navigation']:
+            return None
+        candidates = [
+            marker_id for marker_id in ARUCO_LOCATIONS
+            if marker_id not in self.scanned_markers and marker_id not in self.navigated_markers
+        ]
+        marker_id = self.marker_map.nearest(candidates, self._local_position())
+        if marker_id is None:
+            return None
+        self.navigated_markers.add(marker_id)
+        x, y, z = self.marker_map.approach_point(marker_id, self.speed_settings['target_distance'])
+        yaw = self.marker_map.approach_heading(marker_id)
+        print(f"Перелет по карте к маркеру {marker_id}: ({x:.2f}, {y:.2f}, {z:.2f}), курс {yaw:+.0f}°")
+        if self.controller is not None:
+            self.controller.disable()
+        self._go_to_local_point(x=float(x), y=float(y), z=float(z), yaw=yaw)
+        if not wait_until(self.mini.point_reached, self.speed_settings['point_timeout'],
+                          cancel=self._stop_requested, sleep=self.sleep, clock=self.clock):
+            print(f"⚠️ Точка подлета к маркеру {marker_id} не достигнута за {self.speed_settings['point_timeout']:.0f} с")
+        self.locked_marker_id = marker_id
+        self.marker_lock_time = self.clock()
+        self.marker_lost_frames = 0
+        self.marker_tracker.reset()
+        return marker_id
+
+    def _handle_frame_outage(self):
+        """Реакция на отсутствие кадров: зависание или посадка.
+
+        Возвращает True, если сканирование нужно завершить.
+        """
+        settings = self.watchdog_settings
+        now = self.clock()
+        outage = now - self._last_frame_clock
+        if settings['policy'] == 'land' and outage >= settings['land_after']:
+            error_msg = f"❌ Нет кадров с камеры {outage:.1f} с, завершаю сканирование и сажусь"
+            print(error_msg)
+            self.scan_results['errors'].append(error_msg)
+            if self.telegram_initialized:
+                telegram_queue.put(error_msg)
+            return True
+        if outage < settings['hover_after']:
+            return False
+        if not self._link_lost:
+            self._link_lost = True
+            self.scan_results['link_outages'] += 1
+            print(f"⚠️ Нет кадров с камеры {outage:.1f} с, зависаю на месте")
+        if self._last_hover_command is None or now - self._last_hover_command >= settings['hover_repeat']:
+            self._manual_speed(vx=0, vy=0, vz=0, yaw_rate=0)
+            self._last_hover_command = now
+        return False
+
+    def _register_frame(self):
+        now = self.clock()
+        if self._link_lost:
+            print(f"Видеопоток восстановлен после {now - self._last_frame_clock:.1f} с")
+            self._link_lost = False
+            self._last_hover_command = None
+        self._last_frame_clock = now
+
+    def estimate_marker_pose(self, image_points, marker_id=None):
+        """Положение маркера по его углам: (rvec, tvec, distance) или None.
+
+        На грубом подлете издалека поза не решается: возвращается
+        (None, None, дистанция по видимому размеру маркера).
+        """
+        # Дисторсия снимается только с четырех углов, решатель работает в нормализованных координатах
+        with self.metrics.stage('pose'):
+            normalized_points = self.calibration.normalize_points(image_points, self.frame_size)
+            coarse_distance = distance_from_size(normalized_points, self.size_of_marker)
+            if coarse_distance > self.vision_settings['coarse_pose_distance']:
+                self.pose_estimator.reset(marker_id)
+                return None, None, coarse_distance
+            return self.pose_estimator.estimate(normalized_points, marker_id)
+
+    def _shelf_board(self, marker_id):
+        """(ключ полки, расположение маркеров) для маркера доски или (None, None)"""
+        if not self.vision_settings['shelf_boards']:
+            return None, None
+        shelf = ARUCO_LOCATIONS.get(int(marker_id))
+        layout = SHELF_BOARDS.get(shelf)
+        if layout is None or int(marker_id) not in layout:
+            return None, None
+        return shelf, layout
+
+    def _shelf_marker_ids(self, marker_id):
+        """Все маркеры полки, к которой относится marker_id"""
+        _, layout = self._shelf_board(marker_id)
+        return set(layout) if layout else {marker_id}
+
+    def _index_of_shelf_marker(self, frame_markers, valid_indices):
+        """Индекс любого маркера с полки заблокированного маркера"""
+        _, layout = self._shelf_board(self.locked_marker_id)
+        if not layout:
+            return None
+        for i in valid_indices:
+            if int(frame_markers.ids[i]) in layout:
+                return int(i)
+        return None
+
+    def estimate_board_pose(self, frame_markers, marker_idx, valid_indices):
+        """Совместная поза полки по всем видимым маркерам доски или None"""
+        marker_id = int(frame_markers.ids[marker_idx])
+        shelf, layout = self._shelf_board(marker_id)
+        if layout is None:
+            return None
+        indices = [int(i) for i in valid_indices if int(frame_markers.ids[i]) in layout]
+        if len(indices) < 2:
+            return None
+        try:
+            with self.metrics.stage('pose'):
+                normalized_points = self.calibration.normalize_points(
+                    frame_markers.quads[indices].reshape(-1, 2), self.frame_size
+                )
+                return self.board_pose_estimator.estimate(
+                    normalized_points, frame_markers.ids[indices], shelf, marker_id
+                )
+        except Exception as e:
+            print(f"Ошибка при расчете положения полки {shelf}: {str(e)}")
+            return None
+
+    def _qr_search_roi(self, frame):
+        """Область поиска QR у заблокированного маркера или None для всего кадра"""
+        if self.qr_roi_corners is None or self.qr_roi_misses >= self.vision_settings['qr_roi_max_misses']:
+            return None
+        layouts = self.vision_settings['qr_roi_layouts']
+        layout = layouts.get(self.current_aruco_id, layouts['default'])
+        return marker_guided_roi(self.qr_roi_corners, layout, frame.shape)
+
+    def _register_roi_result(self, found):
+        if found:
+            self.qr_roi_misses = 0
+            return
+        self.qr_roi_misses += 1
+        if self.qr_roi_misses >= self.vision_settings['qr_roi_max_misses']:
+            print("QR не найден в области у маркера, ищу по всему кадру")
+
+    def _qr_frame_is_sharp(self, frame):
+        """Проверка резкости области поиска QR перед декодированием"""
+        if not self.vision_settings['qr_blur_gate']:
+            self.scan_results['qr_decoded_frames'] += 1
+            return True
+        roi = self._qr_search_roi(frame)
+        image = self.preprocessor.variant('raw', roi) if roi else self.preprocessor.gray
+        if self.sharpness_gate.check(image):
+            self.scan_results['qr_decoded_frames'] += 1
+            return True
+        self.scan_results['qr_gated_frames'] += 1
+        return False
+
+    def _decode_qr_with_pool(self, frame, multi):
+        """Декодирование QR в пуле процессов без блокировки цикла управления.
+
+        Забирает результат завершившегося задания и сразу отправляет текущий
+        кадр (или область у маркера), если пул освободился. Возвращает список
+        (строка, точки, размер) в координатах кадра.
+        """
+        results = []
+        finished = self.qr_pool.poll()
+        if finished is not None:
+            pool_results, roi = finished
+            if roi:
+                results = [(string, self.preprocessor.roi_to_frame(points, roi), qr_size)
+                           for string, points, qr_size in pool_results or []]
+                self._register_roi_result(bool(results))
+            else:
+                results = list(pool_results or [])
 
-        return v_x, v_y, v_z, yaw_rate
+        if not self.qr_pool.busy:
+            roi = self._qr_search_roi(frame)
+            if roi:
+                self.qr_pool.submit(self.preprocessor.variant('raw', roi), multi=multi, context=roi)
+            else:
+                self.qr_pool.submit(self.preprocessor.gray, multi=multi, context=None)
+        return results
 
     def process_frame_qr(self, frame):
         """Обработка кадра для поиска QR-кода"""
         if frame is None:
             return None, None, None, None
+        if self.preprocessor.frame is not frame:
+            self.preprocessor.new_frame(frame)
             
         try:
-            frames_to_try = [
-                frame,
-                cv2.GaussianBlur(frame, (5, 5), 0),
-                cv2.GaussianBlur(frame, (7, 7), 0),
-            ]
-            
-            max_qr_size = 0
-            
-            for processed_frame in frames_to_try:
-                string, points, _ = self.qr_detector.detectAndDecode(processed_frame)
-                
-                if string and points is not None and not np.any(np.isnan(points)):
-                    qr_width = np.max(points[0][:, 0]) - np.min(points[0][:, 0])
-                    qr_height = np.max(points[0][:, 1]) - np.min(points[0][:, 1])
-                    qr_size = min(qr_width, qr_height)
-                    
-                    if qr_size > max_qr_size:
-                        max_qr_size = qr_size
-                        self.best_result = (string, points, qr_size)
+            roi = self._qr_search_roi(frame) if self.qr_pool is None else None
+            if self.qr_pool is not None:
+                results = self._decode_qr_with_pool(frame, multi=False)
+                decoded = (*results[0], 'pool') if results else None
+            elif roi:
+                decoded = self.qr_cascade.decode(None, lambda name: self.preprocessor.variant(name, roi))
+                if decoded:
+                    string, points, qr_size, variant = decoded
+                    decoded = (string, self.preprocessor.roi_to_frame(points, roi), qr_size, variant)
+                self._register_roi_result(bool(decoded))
+            else:
+                decoded = self.qr_cascade.decode(None, self.preprocessor.variant)
+
+            if decoded:
+                string, points, qr_size, _ = decoded
+                self.best_result = (string, points, qr_size)
             
             if self.best_result:
                 string, points, qr_size = self.best_result
@@ -341,6 +831,30 @@ class ArucoFlight:
             print(f"Ошибка обработки кадра QR: {str(e)}")
             return None, None, None, None
 
+    def process_frame_qr_multi(self, frame):
+        """Поиск всех QR-кодов в кадре: список (строка, точки, размер) в координатах кадра"""
+        if frame is None:
+            return []
+        if self.preprocessor.frame is not frame:
+            self.preprocessor.new_frame(frame)
+
+        try:
+            roi = self._qr_search_roi(frame) if self.qr_pool is None else None
+            if self.qr_pool is not None:
+                results = self._decode_qr_with_pool(frame, multi=True)
+            elif roi:
+                results = self.qr_cascade.decode_multi(None, lambda name: self.preprocessor.variant(name, roi))
+                results = [(string, self.preprocessor.roi_to_frame(points, roi), qr_size)
+                           for string, points, qr_size in results]
+                self._register_roi_result(bool(results))
+            else:
+                results = self.qr_cascade.decode_multi(None, self.preprocessor.variant)
+            return results
+
+        except Exception as e:
+            print(f"Ошибка обработки кадра QR: {str(e)}")
+            return []
+
     def process_qr_data(self, qr_data):
         """Обработка данных QR-кода и сохранение в БД"""
         try:
@@ -457,29 +971,24 @@ ID: {data['qr_code']}
                 print("❌ Отсутствует UUID сессии")
                 return
 
-            self.scan_results['end_time'] = time.time()
+            self.scan_results['end_time'] = self.clock()
             scan_duration = self.scan_results['end_time'] - self.scan_results['start_time']
             
-            # Сохраняем каждое успешное сканирование QR в историю
-            for qr_code in self.scan_results['scanned_qr']:
-                item = find_item(qr_code)
-                if item:
-                    add_scan_history(
-                        action_type="scan",
-                        item_id=item.id,
-                        result="success",
-                        session_uuid=self.session_uuid
-                    )
+            # Успешные сканирования записываются в историю в process_qr_data
 
             # Сохраняем информацию о неудачных попытках
             for failed_qr in self.scan_results['failed_qr']:
                 add_scan_history(
-                    action_type="scan",
+                    operation="scan",
                     item_id=None,
                     result=f"failed_qr: {failed_qr}",
                     session_uuid=self.session_uuid
                 )
 
+            self.scan_results['frame_gaps'] = self.frame_grabber.frame_gaps
+            self.scan_results['longest_frame_gap'] = round(self.frame_grabber.longest_gap, 2)
+            self.scan_results['camera_reconnects'] = self.frame_grabber.reconnects
+
             # Формируем итоговый отчет для сессии
             report = {
                 'duration': f"{scan_duration:.1f} сек",
@@ -488,6 +997,22 @@ ID: {data['qr_code']}
                 'failed_attempts': list(self.scan_results['failed_qr']),
                 'total_attempts': self.scan_results['total_attempts'],
                 'successful_scans': self.scan_results['successful_scans'],
+                'processed_frames': self.scan_results['processed_frames'],
+                'dropped_frames': self.scan_results['dropped_frames'],
+                'detected_frames': self.scan_results['detected_frames'],
+                'tracked_frames': self.scan_results['tracked_frames'],
+                'qr_gated_frames': self.scan_results['qr_gated_frames'],
+                'qr_decoded_frames': self.scan_results['qr_decoded_frames'],
+                'link_outages': self.scan_results['link_outages'],
+                'frame_gaps': self.scan_results['frame_gaps'],
+                'longest_frame_gap': self.scan_results['longest_frame_gap'],
+                'camera_reconnects': self.scan_results['camera_reconnects'],
+                'control_commands': self.controller.commands if self.controller else 0,
+                'control_stale_holds': self.controller.stale_holds if self.controller else 0,
+                'approaches': self.scan_results['approaches'],
+                'marker_map': self.marker_map.summary(),
+                'qr_variant_stats': self.qr_cascade.stats_summary(),
+                'stage_latency': self.metrics.summary(),
                 'errors': self.scan_results['errors']
             }
             
@@ -500,6 +1025,8 @@ ID: {data['qr_code']}
             
             # Отправляем итоговый отчет в Telegram
             if self.telegram_initialized:
+                approach_times = [a['time_to_target'] for a in report['approaches']]
+                approach_time = f"{sum(approach_times) / len(approach_times):.1f} с" if approach_times else "нет"
                 summary = f"""📊 Итоги сканирования:
 
 ⏱ Длительность: {report['duration']}
@@ -507,6 +1034,11 @@ ID: {data['qr_code']}
 🎯 Обнаружено ArUco маркеров: {len(report['scanned_markers'])}
 ❌ Неудачных попыток: {len(report['failed_attempts'])}
 📝 Всего попыток: {report['total_attempts']}
+🎞 Кадров обработано/пропущено: {report['processed_frames']}/{report['dropped_frames']}
+🔎 ArUco детекция/сопровождение: {report['detected_frames']}/{report['tracked_frames']}
+🌫 QR смазанные/декодированные кадры: {report['qr_gated_frames']}/{report['qr_decoded_frames']}
+📡 Разрывы видео/переподключения: {report['frame_gaps']}/{report['camera_reconnects']} (макс. {report['longest_frame_gap']} с)
+🛬 Подлеты к маркерам: {len(report['approaches'])}, среднее время {approach_time}
 
 🏷 Отсканированные QR: {', '.join(report['scanned_qr']) if report['scanned_qr'] else 'нет'}
 🎯 Маркеры ArUco: {', '.join(map(str, report['scanned_markers'])) if report['scanned_markers'] else 'нет'}"""
@@ -516,6 +1048,14 @@ ID: {data['qr_code']}
 
                 telegram_queue.put(summary)
             
+            print(f"Статистика декодирования QR: {report['qr_variant_stats']}")
+            print(f"Оценка положения маркеров: {self.pose_estimator.stats_summary()}")
+            if self.vision_settings['qr_blur_gate']:
+                print(f"Отсев смазанных кадров: {self.sharpness_gate.stats_summary()}")
+            if self.qr_pool:
+                print(f"Пул декодирования QR: {self.qr_pool.stats_summary()}")
+            if self.metrics.enabled:
+                print(f"Цикл полета: {report['stage_latency']['loop_rate_hz']} Гц, {self.metrics.format_line()}")
             print("✅ Результаты сканирования успешно сохранены")
             
         except Exception as e:
@@ -529,91 +1069,147 @@ ID: {data['qr_code']}
         global msg
         msg = ""
         
-        if not self.mini or not self.camera:
+        if not self.mini or not self.frame_grabber:
             print("Система не инициализирована!")
             return
 
         try:
-            self.scan_results['start_time'] = time.time()
+            self.scan_results['start_time'] = self.clock()
             print("🚀 Начало сканирования...")
             if self.telegram_initialized:
                 telegram_queue.put("🚀 Начало сканирования...")
             
+            if self.stop_file is not None and os.path.exists(self.stop_file):
+                os.remove(self.stop_file)
+            if not self.headless:
+                self.viewer = OverlayViewer(self.window_name, max_fps=VIEWER_MAX_FPS)
+                self.viewer.start()
+            
             self.mini.arm()
             self.mini.takeoff()
             self.is_flying = True  # Устанавливаем флаг полета
-            self.mini.go_to_local_point(x=0, y=0, z=0.95, yaw=0)
-            while not self.mini.point_reached():
-                pass
+            self._go_to_local_point(x=0, y=0, z=0.95)
+            if not wait_until(self.mini.point_reached, self.speed_settings['point_timeout'],
+                              cancel=self._stop_requested, sleep=self.sleep, clock=self.clock):
+                if self._stop_requested():
+                    return
+                print(f"⚠️ Высота поиска не подтверждена за {self.speed_settings['point_timeout']:.0f} с, продолжаю")
+
+            self.controller = FixedRateController(
+                self._send_speed,
+                self.marker_control_command,
+                rate_hz=self.speed_settings['control_rate'],
+                max_age=self.speed_settings['max_estimate_age'],
+                clock=self.clock,
+                threaded=self.speed_settings['control_thread']
+            )
+            self.controller.start()
+            self._fly_to_mapped_marker()
 
-            last_control_time = time.time()
+            last_control_time = self.clock()
             send_manual_speed = False
             target_reached = False
             retreat_mode = False
             retreat_start_time = None
-            retry_count = 0
             current_height = self.speed_settings['min_height']
             search_mode = False
             search_distance = 0
             frames_without_marker = 0
             current_aruco_id = None
+            stop_qr_payloads = set()  # QR-коды, найденные на текущей остановке
+            stop_saved_qr = 0
+            frames_without_new_qr = 0
+            stabilization_start = None  # время начала стабилизации у маркера
             self.best_result = None
             self.search_direction = 1
+            self._last_frame_clock = self.clock()
             print("Инициализация переменных управления завершена")
             
             while True:
-                frame = self.camera.get_cv_frame()          
-                if frame is None:
+                if self._stop_requested():
+                    break
+                # Без потока регулятора: шаг по итогам предыдущего кадра (зависание при устаревшей оценке)
+                self.controller.poll()
+                
+                # Ожидание нового кадра: отражает частоту съемки, а не задержку камеры
+                with self.metrics.stage('frame_wait'):
+                    packet = self.frame_grabber.read(timeout=self.watchdog_settings['frame_timeout'])
+                if packet is None:
+                    if not self.frame_grabber.is_running:
+                        print("Источник кадров остановлен")
+                        break
+                    if self._handle_frame_outage():
+                        break
                     continue
+                self._register_frame()
+                # Возраст кадра от получения из потока до начала обработки
+                self.metrics.record('frame_age', self.clock() - packet.timestamp)
+                self.metrics.loop_tick()
+                frame = packet.frame
+                with self.metrics.stage('preprocess'):
+                    self._update_frame_size(frame)
+                    self.preprocessor.new_frame(frame)
+                marker_overlay = None
+                self.scan_results['processed_frames'] += 1
+                self.scan_results['dropped_frames'] = self.frame_grabber.dropped_frames
 
                 if not target_reached:
                     # Режим следования за ArUco маркером
-                    corners, ids, rejected_img_points = self.aruco_detector.detectMarkers(frame)
+                    gray = self.preprocessor.gray
+                    corners, ids = (), None
+                    marker_tracked = False
+                    
+                    with self.metrics.stage('aruco'):
+                        # Пока маркер заблокирован, сопровождаем его углы без полной детекции
+                        if (self.vision_settings['marker_tracking'] and not retreat_mode
+                                and self.marker_tracker.active
+                                and self.marker_tracker.marker_id == self.locked_marker_id
+                                and not self.marker_tracker.needs_detection()):
+                            tracked_corners = self.marker_tracker.track(gray)
+                            if tracked_corners is not None:
+                                corners = (tracked_corners.reshape(1, 4, 2),)
+                                ids = np.array([[self.locked_marker_id]], dtype=np.int32)
+                                marker_tracked = True
+                                self.scan_results['tracked_frames'] += 1
+                        
+                        if not marker_tracked:
+                            self.marker_tracker.reset()
+                            if self.vision_settings['aruco_pyramid']:
+                                corners, ids, rejected_img_points = self.pyramid_detector.detect(frame, gray)
+                            else:
+                                corners, ids, rejected_img_points = self.aruco_detector.detectMarkers(gray)
+                            self.scan_results['detected_frames'] += 1
                     
                     # Проверяем наличие маркера
                     if np.all(ids is not None) and not retreat_mode:
-                        # Проверяем уверенность детекции для всех маркеров
-                        valid_markers = []
-                        valid_corners = []
-                        for i, marker_id in enumerate(ids):
-                            corners_array = corners[i][0]
-                            side_lengths = []
-                            for j in range(4):
-                                next_j = (j + 1) % 4
-                                side = np.sqrt(
-                                    (corners_array[next_j][0] - corners_array[j][0])**2 +
-                                    (corners_array[next_j][1] - corners_array[j][1])**2
-                                )
-                                side_lengths.append(side)
-                            
-                            marker_confidence = min(side_lengths) / max(side_lengths)
-                            
-                            if marker_confidence >= self.speed_settings['aruco_confidence_threshold']:
-                                if marker_id[0] not in self.scanned_markers:
-                                    valid_markers.append(marker_id)
-                                    valid_corners.append(corners[i])
-                            else:
-                                continue
+                        # Проверяем уверенность детекции для всех маркеров сразу
+                        frame_markers = FrameMarkers(corners, ids, self.estimate_marker_pose)
+                        valid_indices = frame_markers.valid_indices(
+                            self.speed_settings['aruco_confidence_threshold'], self.scanned_markers
+                        )
+                        
+                        self._note_marker_bearings(frame_markers, valid_indices)
                         
                         # Если нет валидных маркеров, продолжаем поиск
-                        if not valid_markers:
+                        if len(valid_indices) == 0:
                             frames_without_marker += 1
                             continue
                             
                         # Находим ближайший маркер среди валидных
-                        nearest_marker_idx = 0
-                        min_distance = float('inf')
-                        locked_marker_found = False
+                        marker_idx = None
                         
                         if self.locked_marker_id is not None:
-                            for i, marker_id in enumerate(valid_markers):
-                                if marker_id[0] == self.locked_marker_id:
-                                    nearest_marker_idx = i
-                                    locked_marker_found = True
-                                    self.marker_lost_frames = 0
-                                    break
+                            marker_idx = frame_markers.index_of(self.locked_marker_id, valid_indices)
+                            if marker_idx is None:
+                                # Для полки с доской блокировка действует на любой ее маркер
+                                marker_idx = self._index_of_shelf_marker(frame_markers, valid_indices)
+                                if marker_idx is not None:
+                                    self.locked_marker_id = int(frame_markers.ids[marker_idx])
+                                    print(f"Переключение на маркер {self.locked_marker_id} той же полки")
+                            if marker_idx is not None:
+                                self.marker_lost_frames = 0
                         
-                        if not locked_marker_found:
+                        if marker_idx is None:
                             if self.locked_marker_id is not None:
                                 self.marker_lost_frames += 1
                                 if self.marker_lost_frames >= self.max_lost_frames:
@@ -625,116 +1221,95 @@ ID: {data['qr_code']}
                                     continue
                             
                             # Ищем ближайший маркер
-                            for i, corners_i in enumerate(valid_corners):
-                                try:
-                                    image_points = corners_i.reshape((4, 2))
-                                    object_points = self.points_of_marker.astype(np.float32)
-                                    
-                                    success, rvecs, tvecs = cv2.solvePnP(
-                                        objectPoints=object_points,
-                                        imagePoints=image_points,
-                                        cameraMatrix=self.camera_matrix,
-                                        distCoeffs=self.dist_coeffs,
-                                        flags=cv2.SOLVEPNP_ITERATIVE
-                                    )
-                                    
-                                    if success:
-                                        distance = np.sqrt(np.sum(np.array([tvecs[0, 0], tvecs[1, 0], tvecs[2, 0]])**2))
-                                        if distance < min_distance:
-                                            min_distance = distance
-                                            nearest_marker_idx = i
-                                except Exception as e:
-                                    print(f"Ошибка при расчете расстояния до маркера {valid_markers[i][0]}: {str(e)}")
-                                    continue
+                            marker_idx = frame_markers.nearest(valid_indices)
+                            if marker_idx is None:
+                                marker_idx = int(valid_indices[0])
                             
-                            self.locked_marker_id = valid_markers[nearest_marker_idx][0]
-                            self.marker_lock_time = time.time()
+                            self.locked_marker_id = int(frame_markers.ids[marker_idx])
+                            self.marker_lock_time = self.clock()
                             print(f"Заблокирован новый маркер {self.locked_marker_id}")
                         
-                        current_aruco_id = valid_markers[nearest_marker_idx][0]
+                        current_aruco_id = int(frame_markers.ids[marker_idx])
                         frames_without_marker = 0
                         search_mode = False
                         search_distance = 0
                         
                         self.current_aruco_id = current_aruco_id
+                        marker_confidence = frame_markers.confidence[marker_idx]
                         
-                        corners_array = valid_corners[nearest_marker_idx][0]
-                        x_center = int(np.mean(corners_array[:, 0]))
-                        y_center = int(np.mean(corners_array[:, 1]))
+                        corners_array = frame_markers.quads[marker_idx]
+                        x_center = int(frame_markers.centers[marker_idx][0])
+                        y_center = int(frame_markers.centers[marker_idx][1])
                         
-                        dot_size = 5
-                        cv2.rectangle(frame, 
-                                    (x_center-dot_size, y_center-dot_size),
-                                    (x_center+dot_size, y_center+dot_size),
-                                    (0, 0, 255), -1)
+                        if self.vision_settings['marker_tracking'] and not marker_tracked:
+                            self.marker_tracker.start(gray, corners_array, current_aruco_id)
                         
-                        cv2.aruco.drawDetectedMarkers(frame, corners)
+                        marker_overlay = (corners, (x_center, y_center), marker_confidence)
                         
                         try:
-                            image_points = corners_array.reshape((4, 2))
-                            object_points = self.points_of_marker.astype(np.float32)
-                            
-                            success, rvecs, tvecs = cv2.solvePnP(
-                                objectPoints=object_points,
-                                imagePoints=image_points,
-                                cameraMatrix=self.camera_matrix,
-                                distCoeffs=self.dist_coeffs,
-                                flags=cv2.SOLVEPNP_ITERATIVE
-                            )
+                            marker_pose = (self.estimate_board_pose(frame_markers, marker_idx, valid_indices)
+                                           or frame_markers.pose(marker_idx))
                             
-                            if success:
-                                coordinates = [tvecs[0, 0], tvecs[1, 0], tvecs[2, 0]]
-                                distance = np.sqrt(np.sum(np.array(coordinates)**2))
+                            if marker_pose:
+                                rvecs, tvecs, distance = marker_pose
+                                self.last_marker_pose = (current_aruco_id, distance)
                                 
                                 is_at_distance = (abs(distance - self.speed_settings['target_distance']) <= self.speed_settings['distance_threshold'])
+                                
+                                # Проверяем центрирование
+                                x_center_error = abs(x_center - frame.shape[1]/2)
+                                y_center_error = abs(y_center - frame.shape[0]/2)
+                                
+                                is_centered = is_at_distance and (x_center_error < self.speed_settings['precise_center_threshold'] and 
+                                                                  y_center_error < self.speed_settings['precise_center_threshold'])
+                                
+                                if is_centered:
+                                    # Зависаем, пока оценка положения не перестанет меняться
+                                    if stabilization_start is None:
+                                        print("✅ Центрирование выполнено, жду стабилизации...")
+                                        self._finish_approach(current_aruco_id)
+                                        stabilization_start = self.clock()
+                                        self.pose_stability.reset()
+                                        self._manual_speed(vx=0, vy=0, vz=0, yaw_rate=0)
+                                    self.pose_stability.add(distance, x_center, y_center)
+                                    stabilization_elapsed = self.clock() - stabilization_start
+                                    if (not self.pose_stability.stable
+                                            and stabilization_elapsed < self.speed_settings['stabilization_time']):
+                                        continue
+                                    
+                                    print(f"✅ Положение стабилизировалось за {stabilization_elapsed:.1f} с, переключаюсь в режим поиска QR...")
+                                    self._update_marker_map(frame_markers, marker_idx)
+                                    stabilization_start = None
+                                    target_reached = True
+                                    stop_qr_payloads = set()
+                                    stop_saved_qr = 0
+                                    frames_without_new_qr = 0
+                                    self.marker_tracker.reset()
+                                    self.sharpness_gate.reset()
+                                    self.qr_votes.reset()
+                                    self.qr_roi_corners = corners_array.copy()
+                                    self.qr_roi_misses = 0
+                                    # Поисковое движение отсчитывается от начала остановки
+                                    last_control_time = self.clock()
+                                    continue
+                                
+                                stabilization_start = None
                                 if is_at_distance:
                                     print("✅ На правильной дистанции, центрируюсь...")
-                                    
-                                    # Проверяем центрирование
-                                    x_center_error = abs(x_center - frame.shape[1]/2)
-                                    y_center_error = abs(y_center - frame.shape[0]/2)
-                                    
-                                    is_centered = (x_center_error < self.speed_settings['precise_center_threshold'] and 
-                                                 y_center_error < self.speed_settings['precise_center_threshold'])
-                                    
-                                    if is_centered:
-                                        print("✅ Центрирование выполнено, переключаюсь в режим поиска QR...")
-                                        target_reached = True
-                                        time.sleep(5.0)
-                                        self.mini.set_manual_speed_body_fixed(vx=0, vy=0, vz=0, yaw_rate=0)
-                                        continue
-                                    else:
-                                        # Продолжаем центрирование
-                                        current_time = time.time()
-                                        if current_time - last_control_time >= self.speed_settings['control_delay']:
-                                            v_x = self.speed_settings['centering_speed'] * (x_center - frame.shape[1]/2) / (frame.shape[1]/2)
-                                            v_z = -self.speed_settings['vertical_speed'] * (y_center - frame.shape[0]/2) / (frame.shape[0]/2)
-                                            yaw_rate = self.speed_settings['yaw_speed'] * (x_center - frame.shape[1]/2) / (frame.shape[1]/2)
-                                            
-                                            v_x = np.clip(v_x, -self.speed_settings['centering_speed'], self.speed_settings['centering_speed'])
-                                            v_z = np.clip(v_z, -self.speed_settings['vertical_speed'], self.speed_settings['vertical_speed'])
-                                            yaw_rate = np.clip(yaw_rate, -self.speed_settings['yaw_speed'], self.speed_settings['yaw_speed'])
-                                            
-                                            print(f"Центрирование: X={x_center_error:.1f}, Y={y_center_error:.1f}")
-                                            self.mini.set_manual_speed_body_fixed(
-                                                vx=v_x, vy=0, vz=v_z, yaw_rate=yaw_rate
-                                            )
-                                            last_control_time = current_time
-                                else:
-                                    current_time = time.time()
-                                    if current_time - last_control_time >= self.speed_settings['control_delay']:
-                                        v_x, v_y, v_z, yaw_rate = self.calculate_control_speed(
-                                            distance, x_center, y_center, frame.shape[0], frame.shape[1]
-                                        )
-                                        
-                                        if abs(v_z) > 0 and distance < self.speed_settings['target_distance'] * 1.2:
-                                            v_y *= 0.5
-                                        
-                                        self.mini.set_manual_speed_body_fixed(
-                                            vx=v_x, vy=v_y, vz=v_z, yaw_rate=yaw_rate
-                                        )
-                                        send_manual_speed = True
-                                        last_control_time = current_time
+                                
+                                if self.approach is None or self.approach['marker_id'] != current_aruco_id:
+                                    self.approach = {
+                                        'marker_id': current_aruco_id,
+                                        'start': self.clock(),
+                                        'commands': self.controller.commands,
+                                    }
+                                # Команды скорости отправляет регулятор по последней оценке
+                                self.controller.estimate.write(ControlEstimate(
+                                    packet.timestamp, current_aruco_id, distance,
+                                    x_center, y_center, frame.shape[1], frame.shape[0]
+                                ))
+                                self.controller.enable()
+                                self.controller.poll()
 
                         except Exception as e:
                             print(f"Ошибка при расчете положения: {str(e)}")
@@ -742,53 +1317,53 @@ ID: {data['qr_code']}
                     else:
                         # Маркер не найден или режим отлета
                         if retreat_mode:
-                            current_time = time.time()
-                            retreat_elapsed_time = current_time - retreat_start_time
+                            frame_markers = None
+                            if ids is not None:
+                                frame_markers = FrameMarkers(corners, ids, self.estimate_marker_pose)
+                                self._note_marker_bearings(frame_markers, frame_markers.valid_indices(
+                                    self.speed_settings['aruco_confidence_threshold'], self.scanned_markers
+                                ))
+                            retreat_moved, retreat_source = self._retreat_progress(frame_markers)
+                            retreat_elapsed_time = self.clock() - retreat_start_time
                             
-                            if retreat_elapsed_time < self.speed_settings['retreat_time']:
+                            if (retreat_moved < self.speed_settings['retreat_distance']
+                                    and retreat_elapsed_time < self.speed_settings['retreat_timeout']):
                                 # Продолжаем отлет
-                                self.mini.set_manual_speed_body_fixed(
+                                self._manual_speed(
                                     vx=0, vy=-self.speed_settings['retreat_speed'], vz=0, yaw_rate=0
                                 )
                             else:
                                 # Завершаем отлет и начинаем поиск
-                                self.mini.set_manual_speed_body_fixed(vx=0, vy=0, vz=0, yaw_rate=0)
+                                self._manual_speed(vx=0, vy=0, vz=0, yaw_rate=0)
                                 retreat_mode = False
                                 target_reached = False
-                                print("Отлет завершен, начинаю поиск новых маркеров")
+                                self.retreat = None
+                                if retreat_moved < self.speed_settings['retreat_distance']:
+                                    print(f"⚠️ Отлет остановлен по времени: {retreat_moved:.2f} м ({retreat_source})")
+                                else:
+                                    print(f"Отлет завершен: {retreat_moved:.2f} м за {retreat_elapsed_time:.1f} с ({retreat_source})")
                                 frames_without_marker = 0
                                 
-                                self.yaw_search = {
-                                    'active': True,
-                                    'current_angle': 0,
-                                    'direction': 1,
-                                    'min_angle': -45,
-                                    'max_angle': 45,
-                                    'step_rate': 15
-                                }
-                                print(f"Начинаю поворот для поиска маркеров (угол: {self.yaw_search['current_angle']}°)")
-                                last_control_time = time.time()
+                                if self._fly_to_mapped_marker() is None:
+                                    self._start_yaw_search()
+                                last_control_time = self.clock()
                         else:
                             frames_without_marker += 1
                             
                             if frames_without_marker > 5 and self.yaw_search['active']:
-                                current_time = time.time()
+                                current_time = self.clock()
                                 if current_time - last_control_time >= self.speed_settings['control_delay']:
+                                    # Угол поворота - по счисленному курсу от начала поиска
+                                    new_angle = self.heading.heading - self.yaw_search['start_heading']
+                                    if new_angle * self.yaw_search['direction'] >= abs(self.yaw_search['max_angle']):
+                                        self.yaw_search['direction'] *= -1
+                                        print(f"Достигнут предельный угол ({new_angle:.1f}°), меняю направление")
+                                    
                                     yaw_rate = self.yaw_search['direction'] * self.speed_settings['yaw_speed']
-                                    self.mini.set_manual_speed_body_fixed(
+                                    self._manual_speed(
                                         vx=0, vy=0, vz=0, yaw_rate=yaw_rate
                                     )
                                     
-                                    new_angle = self.yaw_search['current_angle'] + (
-                                        self.yaw_search['direction'] * 
-                                        self.yaw_search['step_rate'] * 
-                                        self.speed_settings['control_delay']
-                                    )
-                                    
-                                    if abs(new_angle) >= abs(self.yaw_search['max_angle']):
-                                        self.yaw_search['direction'] *= -1
-                                        print(f"Достигнут предельный угол ({new_angle:.1f}°), меняю направление")
-                                    
                                     self.yaw_search['current_angle'] = new_angle
                                     print(f"Поиск маркеров: поворот на {new_angle:.1f}°")
                                     last_control_time = current_time
@@ -801,52 +1376,107 @@ ID: {data['qr_code']}
                             if frames_without_marker > 10 and not retreat_mode:
                                 print("Маркер потерян, начинаю отлет...")
                                 retreat_mode = True
-                                retreat_start_time = time.time()
+                                retreat_start_time = self.clock()
                                 target_reached = False
                                 self.yaw_search['active'] = False
-                                
-                                self.mini.set_manual_speed_body_fixed(
-                                    vx=0, vy=-self.speed_settings['retreat_speed'], vz=0, yaw_rate=0
-                                )
+                                self._begin_retreat()
 
                 else:
-                    # Сбрасываем результат предыдущего сканирования
-                    self.best_result = None
-                    qr_data, qr_x, qr_y, qr_size = self.process_frame_qr(frame)
-                    if qr_data:
-                        print(f"🎯 Найден QR-код: {qr_data}")
-                        if self.process_qr_data(qr_data):
-                            print("✅ QR-код успешно обработан и сохранен")
-                            self.scan_results['successful_scans'] += 1
-                            self.scan_results['scanned_qr'].add(qr_data)
+                    qr_visible = False
+                    with self.metrics.stage('sharpness'):
+                        qr_sharp = self._qr_frame_is_sharp(frame)
+                    if not qr_sharp:
+                        # Кадр смазан (дрон еще движется) - ждем следующий
+                        pass
+                    elif self.vision_settings['qr_multi_decode']:
+                        # Все QR-коды полки обрабатываются за одну остановку
+                        with self.metrics.stage('qr'):
+                            qr_detections = self.process_frame_qr_multi(frame)
+                        qr_visible = bool(qr_detections)
+                        # Содержимое принимается только по итогам голосования за несколько кадров
+                        accepted_payloads, rejected_payloads = self.qr_votes.add_frame(qr_detections)
+                        
+                        for qr_data in accepted_payloads:
+                            stop_qr_payloads.add(qr_data)
+                            print(f"🎯 Найден QR-код: {qr_data}")
+                            with self.metrics.stage('db'):
+                                saved = self.process_qr_data(qr_data)
+                            if saved:
+                                stop_saved_qr += 1
+                                self.scan_results['scanned_qr'].add(qr_data)
+                            else:
+                                print("❌ Ошибка при обработке QR-кода")
+                                self.scan_results['failed_qr'].add(qr_data)
+                        
+                        for qr_data in rejected_payloads:
+                            stop_qr_payloads.add(qr_data)
+                            print(f"❌ QR-код не удалось прочитать уверенно: {qr_data}")
+                            self.scan_results['failed_qr'].add(qr_data)
+                        
+                        if accepted_payloads or rejected_payloads:
+                            frames_without_new_qr = 0
+                        elif stop_qr_payloads:
+                            frames_without_new_qr += 1
+                        
+                        if (stop_qr_payloads and not self.qr_votes.pending
+                                and frames_without_new_qr >= self.vision_settings['qr_multi_settle_frames']):
+                            if stop_saved_qr:
+                                print(f"✅ Набор QR-кодов на полке не меняется, обработано: {stop_saved_qr}")
+                                if current_aruco_id is not None:
+                                    shelf_markers = self._shelf_marker_ids(current_aruco_id)
+                                    self.scanned_markers.update(shelf_markers)
+                                    self.scan_results['scanned_markers'].update(shelf_markers)
+                                    print(f"Маркеры {sorted(shelf_markers)} добавлены в список отсканированных")
+                            else:
+                                print("❌ Ни один QR-код полки не удалось обработать")
                             
-                            if current_aruco_id is not None:
-                                self.scanned_markers.add(current_aruco_id)
-                                self.scan_results['scanned_markers'].add(current_aruco_id)
-                                print(f"Маркер {current_aruco_id} добавлен в список отсканированных")
-
                             if not retreat_mode:
                                 retreat_mode = True
-                                retreat_start_time = time.time()
+                                retreat_start_time = self.clock()
                                 target_reached = False
-                                print("Начинаю отлет после успешного сканирования QR-кода...")
-                                self.mini.set_manual_speed_body_fixed(
-                                    vx=0, vy=-self.speed_settings['retreat_speed'], vz=0, yaw_rate=0
-                                )
-                        else:
-                            print("❌ Ошибка при обработке QR-кода")
-                            self.scan_results['failed_qr'].add(qr_data)
-                            retry_count += 1
-                            if retry_count >= 5 and not retreat_mode:
-                                print("Превышено количество попыток чтения QR-кода")
-                                retreat_mode = True
-                                retreat_start_time = time.time()
-                                target_reached = False
-                                self.mini.set_manual_speed_body_fixed(
-                                    vx=0, vy=-self.speed_settings['retreat_speed'], vz=0, yaw_rate=0
-                                )
+                                print("Начинаю отлет после сканирования QR-кодов полки...")
+                                self._begin_retreat()
                     else:
-                        current_time = time.time()
+                        # Сбрасываем результат предыдущего сканирования
+                        self.best_result = None
+                        with self.metrics.stage('qr'):
+                            qr_data, qr_x, qr_y, qr_size = self.process_frame_qr(frame)
+                        qr_visible = bool(qr_data)
+                        accepted_payloads, rejected_payloads = self.qr_votes.add_frame(
+                            [self.best_result] if self.best_result else []
+                        )
+                        
+                        for qr_data in accepted_payloads:
+                            print(f"🎯 Найден QR-код: {qr_data}")
+                            with self.metrics.stage('db'):
+                                saved = self.process_qr_data(qr_data)
+                            if saved:
+                                print("✅ QR-код успешно обработан и сохранен")
+                                self.scan_results['scanned_qr'].add(qr_data)
+                            
+                                if current_aruco_id is not None:
+                                    shelf_markers = self._shelf_marker_ids(current_aruco_id)
+                                    self.scanned_markers.update(shelf_markers)
+                                    self.scan_results['scanned_markers'].update(shelf_markers)
+                                    print(f"Маркеры {sorted(shelf_markers)} добавлены в список отсканированных")
+                            else:
+                                print("❌ Ошибка при обработке QR-кода")
+                                self.scan_results['failed_qr'].add(qr_data)
+                        
+                        for qr_data in rejected_payloads:
+                            print(f"❌ QR-код не удалось прочитать уверенно: {qr_data}")
+                            self.scan_results['failed_qr'].add(qr_data)
+                        
+                        if (accepted_payloads or rejected_payloads) and not retreat_mode:
+                            retreat_mode = True
+                            retreat_start_time = self.clock()
+                            target_reached = False
+                            print("Начинаю отлет после сканирования QR-кода...")
+                            self._begin_retreat()
+                    # Пока QR ищется в области у маркера, дрон не смещается: поисковое
+                    # движение начинается после перехода на весь кадр (qr_roi_max_misses)
+                    if qr_sharp and not qr_visible and self._qr_search_roi(frame) is None:
+                        current_time = self.clock()
                         if current_time - last_control_time >= self.speed_settings['control_delay']:
                             print("❌ QR не найден, выполняю поисковое движение...")
                             
@@ -863,7 +1493,7 @@ ID: {data['qr_code']}
                                 else:
                                     vertical_speed = -self.speed_settings['vertical_speed'] * 0.5
                             
-                            self.mini.set_manual_speed_body_fixed(
+                            self._manual_speed(
                                 vx=0, vy=0, vz=vertical_speed, yaw_rate=0
                             )
                             
@@ -873,51 +1503,48 @@ ID: {data['qr_code']}
                             speed_str = 'быстро' if abs(vertical_speed) == self.speed_settings['vertical_speed'] else 'медленно'
                             last_control_time = current_time
 
-                text_frame = frame.copy()
-                
-                if not target_reached:
-                    mode_text = "ArUco Following"
-                    if search_mode:
-                        mode_text += f" (Search: {search_distance:.2f}m)"
-                else:
-                    mode_text = f"QR Search (Height: {current_height:.2f}m)"
-                cv2.putText(text_frame, mode_text, (10, 25), 
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-
-                if not target_reached and not retreat_mode and 'marker_confidence' in locals():
-                    confidence_color = (0, 255, 0) if marker_confidence >= self.speed_settings['aruco_confidence_threshold'] else (0, 0, 255)
-                    cv2.putText(text_frame, f"Confidence: {marker_confidence:.2f}", (10, 50),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, confidence_color, 2)
-
-                if self.scanned_markers:
-                    scanned_text = f"Scanned ArUco: {sorted(list(self.scanned_markers))}"
-                    cv2.putText(text_frame, scanned_text, (10, text_frame.shape[0] - 15),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
-
-                if retreat_mode:
-                    retreat_elapsed_time = time.time() - retreat_start_time
-                    retreat_msg = f"Retreat: {retreat_elapsed_time:.1f} sec"
-                    cv2.putText(text_frame, retreat_msg, (10, text_frame.shape[0] - 40),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
-
-                cv2.imshow(self.window_name, text_frame)
-                
-                key = cv2.waitKey(1)
-                if key == 27 or cv2.getWindowProperty(self.window_name, cv2.WND_PROP_VISIBLE) < 1:
-                    print("Получен сигнал завершения (ESC или окно закрыто)")
-                    break
+                if self.viewer is not None:
+                    if not target_reached:
+                        mode_text = "ArUco Following"
+                        if search_mode:
+                            mode_text += f" (Search: {search_distance:.2f}m)"
+                    else:
+                        mode_text = f"QR Search (Height: {current_height:.2f}m)"
+                    
+                    overlay = {
+                        'mode_text': mode_text,
+                        'confidence_threshold': self.speed_settings['aruco_confidence_threshold'],
+                        'scanned_markers': sorted(self.scanned_markers),
+                    }
+                    if marker_overlay is not None:
+                        overlay['marker_corners'], overlay['marker_center'], confidence = marker_overlay
+                        if not target_reached and not retreat_mode:
+                            overlay['confidence'] = confidence
+                    if retreat_mode:
+                        overlay['retreat_elapsed'] = self.clock() - retreat_start_time
+                    with self.metrics.stage('gui'):
+                        self.viewer.submit(frame, overlay)
 
         except Exception as e:
             error_msg = f"Критическая ошибка: {str(e)}"
             self.scan_results['errors'].append(error_msg)
             print(error_msg)
         finally:
+            if self.controller is not None:
+                self.controller.stop()
             self.save_scan_results()
-            cv2.destroyWindow(self.window_name)
+            if self.viewer is not None:
+                self.viewer.stop()
             self.safe_landing()
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--replay':
+        # Воспроизведение записи без дрона: flight.py --replay <путь> [параметры]
+        from replay import main as replay_main
+        replay_main(sys.argv[2:])
+        return
+
     chat_id = sys.argv[1] if len(sys.argv) > 1 else None
     session_uuid = sys.argv[2] if len(sys.argv) > 2 else None
     
@@ -927,7 +1554,6 @@ def main():
         if not drone.initialize():
             return
             
-        cv2.namedWindow(drone.window_name)
         drone.fly()
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,144 @@
+import time
+from typing import Dict
+
+import numpy as np
+
+
+class _NullStage:
+    """Заглушка таймера, когда замеры выключены"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, metrics: 'FlightMetrics', name: str):
+        self.metrics = metrics
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _Window:
+    """Скользящее окно последних значений и общие счетчики этапа"""
+
+    def __init__(self, size: int):
+        self.values = np.zeros(size, dtype=np.float64)
+        self.index = 0
+        self.filled = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.values)
+        self.filled = min(self.filled + 1, len(self.values))
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+
+class FlightMetrics:
+    """Замеры задержек по этапам цикла полета.
+
+    Для каждого этапа хранится скользящее окно длительностей, по которому
+    считаются p50/p95/p99, и общие счетчики за сессию. При enabled=False
+    stage() возвращает общий пустой контекст и почти ничего не стоит.
+    """
+
+    def __init__(self, enabled: bool = False, window: int = 500, print_interval: float = 0.0):
+        self.enabled = enabled
+        self.window = window
+        self.print_interval = print_interval  # период вывода строки статистики, 0 - не выводить
+        self._windows: Dict[str, _Window] = {}
+        self._stages: Dict[str, _Stage] = {}
+        self._started = time.monotonic()
+        self._last_print = self._started
+        self._loops_since_print = 0
+        self._last_tick = None
+        self.loops = 0
+
+    def stage(self, name: str):
+        """Контекст замера этапа: with metrics.stage('aruco'): ..."""
+        if not self.enabled:
+            return _NULL_STAGE
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = self._stages[name] = _Stage(self, name)
+        return stage
+
+    def record(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        window = self._windows.get(name)
+        if window is None:
+            window = self._windows[name] = _Window(self.window)
+        window.add(seconds)
+
+    def loop_tick(self):
+        """Отметка итерации цикла полета и периодический вывод статистики.
+
+        Интервал между отметками записывается как этап 'loop'.
+        """
+        if not self.enabled:
+            return
+        tick = time.perf_counter()
+        if self._last_tick is not None:
+            self.record('loop', tick - self._last_tick)
+        self._last_tick = tick
+        self.loops += 1
+        self._loops_since_print += 1
+        if not self.print_interval:
+            return
+        now = time.monotonic()
+        if now - self._last_print >= self.print_interval:
+            rate = self._loops_since_print / (now - self._last_print)
+            print(f"⏱ {rate:.1f} Гц | {self.format_line()}")
+            self._last_print = now
+            self._loops_since_print = 0
+
+    def percentiles(self, name: str) -> Dict[str, float]:
+        window = self._windows[name]
+        values = window.values[:window.filled]
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+        return {'p50_ms': round(float(p50), 2), 'p95_ms': round(float(p95), 2), 'p99_ms': round(float(p99), 2)}
+
+    def format_line(self) -> str:
+        parts = []
+        for name in self._windows:
+            p = self.percentiles(name)
+            parts.append(f"{name} {p['p50_ms']:.1f}/{p['p95_ms']:.1f}/{p['p99_ms']:.1f}")
+        return "этап p50/p95/p99 мс: " + ", ".join(parts) if parts else "нет замеров"
+
+    def summary(self) -> Dict:
+        """Итоги сессии для отчета"""
+        if not self.enabled:
+            return {}
+        elapsed = time.monotonic() - self._started
+        stages = {}
+        for name, window in self._windows.items():
+            stages[name] = {
+                'count': window.count,
+                'mean_ms': round(window.total / window.count * 1000, 2),
+                'max_ms': round(window.max * 1000, 2),
+                **self.percentiles(name)
+            }
+        return {
+            'loops': self.loops,
+            'loop_rate_hz': round(self.loops / elapsed, 2) if elapsed > 0 else 0.0,
+            'stages': stages,
+        }
@@ -0,0 +1,117 @@
+from typing import Callable, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Варианты предобработки полутонового изображения: (src, dst) -> результат.
+# dst - переиспользуемый буфер того же размера или None
+PREPROCESSING_VARIANTS: Dict[str, Callable[[np.ndarray, Optional[np.ndarray]], np.ndarray]] = {
+    'raw': lambda src, dst: src,
+    'blur5': lambda src, dst: cv2.GaussianBlur(src, (5, 5), 0, dst=dst),
+    'blur7': lambda src, dst: cv2.GaussianBlur(src, (7, 7), 0, dst=dst),
+    'equalized': lambda src, dst: cv2.equalizeHist(src, dst=dst),
+}
+
+
+class FramePreprocessor:
+    """Общая предобработка кадра для детекторов ArUco и QR.
+
+    Кадр переводится в оттенки серого один раз в переиспользуемый буфер.
+    Размытые и выровненные варианты строятся лениво при первом запросе
+    (для всего кадра или для области) и кэшируются до следующего кадра.
+    Если заданы карты устранения дисторсии, области берутся из исправленного
+    изображения (remap только по области, карты считаются заранее); точки,
+    найденные в такой области, переводятся в координаты исходного кадра
+    через roi_to_frame().
+    """
+
+    def __init__(self):
+        self.frame: Optional[np.ndarray] = None
+        self._gray: Optional[np.ndarray] = None
+        self._buffers: Dict[str, np.ndarray] = {}
+        self._cache: Dict[Tuple[str, Optional[Tuple[int, int, int, int]]], np.ndarray] = {}
+        self._undistort_maps = None
+        self._camera = None
+
+    def set_undistort_maps(self, maps, camera_matrix=None, dist_coeffs=None):
+        """Карты cv2.initUndistortRectifyMap для областей или None.
+
+        camera_matrix - матрица камеры, по которой построены карты (она же
+        матрица исправленного изображения), dist_coeffs - коэффициенты дисторсии.
+        """
+        self._undistort_maps = maps
+        self._camera = None if maps is None else (
+            np.asarray(camera_matrix, dtype=np.float64), np.asarray(dist_coeffs, dtype=np.float64)
+        )
+        self._cache.clear()
+
+    def roi_to_frame(self, points: np.ndarray, roi: Tuple[int, int, int, int]) -> np.ndarray:
+        """Точки, найденные в области roi, в координатах исходного (искаженного) кадра"""
+        points = np.asarray(points, dtype=np.float32)
+        shifted = points.reshape(-1, 2) + np.array(roi[:2], dtype=np.float32)
+        if self._undistort_maps is None:
+            return shifted.reshape(points.shape)
+
+        # Исправленные пиксели -> нормализованные координаты -> проекция с дисторсией
+        camera_matrix, dist_coeffs = self._camera
+        normalized = cv2.undistortPoints(shifted.reshape(-1, 1, 2), camera_matrix, None)
+        distorted, _ = cv2.projectPoints(
+            cv2.convertPointsToHomogeneous(normalized), np.zeros(3), np.zeros(3), camera_matrix, dist_coeffs
+        )
+        return distorted.reshape(points.shape).astype(np.float32)
+
+    def new_frame(self, frame: np.ndarray):
+        """Начало обработки нового кадра"""
+        self.frame = frame
+        self._cache.clear()
+        if frame.ndim == 2:
+            self._gray = frame
+            return
+        shape = frame.shape[:2]
+        if self._gray is None or self._gray.shape != shape or self._gray is self.frame:
+            self._gray = np.empty(shape, dtype=np.uint8)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+
+    @property
+    def gray(self) -> np.ndarray:
+        return self._gray
+
+    def variant(self, name: str, roi: Optional[Tuple[int, int, int, int]] = None) -> np.ndarray:
+        """Вариант предобработки полутонового кадра или его области (x0, y0, x1, y1)"""
+        key = (name, roi)
+        if key in self._cache:
+            return self._cache[key]
+
+        source = self._gray
+        if roi is not None:
+            source = self._region(roi)
+
+        if name == 'raw':
+            result = source
+        else:
+            buffer_key = f"{name}:{'roi' if roi else 'full'}"
+            buffer = self._buffers.get(buffer_key)
+            if buffer is None or buffer.shape != source.shape:
+                buffer = np.empty(source.shape, dtype=source.dtype)
+                self._buffers[buffer_key] = buffer
+            result = PREPROCESSING_VARIANTS[name](source, buffer)
+
+        self._cache[key] = result
+        return result
+
+    def _region(self, roi: Tuple[int, int, int, int]) -> np.ndarray:
+        x0, y0, x1, y1 = roi
+        if self._undistort_maps is None:
+            return self._gray[y0:y1, x0:x1]
+
+        key = ('undistorted', roi)
+        if key not in self._cache:
+            map1, map2 = self._undistort_maps
+            buffer = self._buffers.get('undistorted')
+            if buffer is None or buffer.shape != (y1 - y0, x1 - x0):
+                buffer = np.empty((y1 - y0, x1 - x0), dtype=self._gray.dtype)
+                self._buffers['undistorted'] = buffer
+            self._cache[key] = cv2.remap(
+                self._gray, map1[y0:y1, x0:x1], map2[y0:y1, x0:x1], cv2.INTER_LINEAR, dst=buffer
+            )
+        return self._cache[key]
@@ -0,0 +1,154 @@
+import threading
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+
+class FramePacket(NamedTuple):
+    """Кадр камеры с меткой времени захвата и порядковым номером"""
+    frame: np.ndarray
+    timestamp: float
+    seq: int
+
+
+class LatestFrameGrabber:
+    """Поток захвата кадров с камеры дрона.
+
+    Поток единолично владеет камерой pioneer_sdk: принимает и декодирует JPEG
+    и хранит только самый свежий кадр. Используется тройная буферизация:
+    поток пишет в свой буфер, публикует его обменом со слотом последнего кадра,
+    а читатель забирает слот обменом со своим буфером. Буферы выделяются один
+    раз (и заново только при смене размера кадра).
+
+    Сторожевой таймер: при пропаже кадров пауза между опросами камеры растет
+    экспоненциально до max_backoff, а через reconnect_after секунд без кадров
+    камера переподключается (интервал между попытками тоже удваивается).
+    Разрывы потока длиннее gap_threshold и переподключения считаются.
+    """
+
+    def __init__(self, camera, idle_delay: float = 0.005, max_backoff: float = 0.2,
+                 reconnect_after: float = 2.0, max_reconnect_interval: float = 16.0,
+                 gap_threshold: float = 0.5):
+        self.camera = camera
+        self.idle_delay = idle_delay  # пауза, если камера не отдала кадр
+        self.max_backoff = max_backoff
+        self.reconnect_after = reconnect_after
+        self.max_reconnect_interval = max_reconnect_interval
+        self.gap_threshold = gap_threshold
+        self._lock = threading.Lock()
+        self._frame_ready = threading.Condition(self._lock)
+        self._write_buffer: Optional[np.ndarray] = None
+        self._latest_buffer: Optional[np.ndarray] = None
+        self._read_buffer: Optional[np.ndarray] = None
+        self._latest_timestamp = 0.0
+        self._latest_seq = 0
+        self._last_read_seq = 0
+        self._running = False
+        self._thread = None
+        self.captured_frames = 0  # всего принято кадров
+        self.dropped_frames = 0   # кадров, вытесненных до чтения
+        self.frame_gaps = 0       # разрывов потока длиннее gap_threshold
+        self.longest_gap = 0.0    # самый длинный разрыв, с
+        self.reconnects = 0       # переподключений камеры
+        self._last_frame_time: Optional[float] = None
+
+    def start(self):
+        """Запуск потока захвата"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, name="frame-grabber")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        """Остановка потока захвата"""
+        with self._lock:
+            self._running = False
+            self._frame_ready.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    def _reconnect(self):
+        print("⚠️ Нет кадров с камеры, переподключаюсь...")
+        self.reconnects += 1
+        try:
+            self.camera.disconnect()
+        except Exception:
+            pass
+        try:
+            if self.camera.connect():
+                print("Камера переподключена")
+            else:
+                print("Не удалось переподключиться к камере")
+        except Exception as e:
+            print(f"Ошибка переподключения камеры: {str(e)}")
+
+    def _capture_loop(self):
+        misses = 0
+        reconnect_interval = self.reconnect_after
+        next_reconnect = time.monotonic() + reconnect_interval
+        while self._running:
+            try:
+                frame = self.camera.get_cv_frame()
+            except Exception as e:
+                print(f"Ошибка получения кадра: {str(e)}")
+                frame = None
+            if frame is None:
+                misses += 1
+                if time.monotonic() >= next_reconnect:
+                    self._reconnect()
+                    reconnect_interval = min(reconnect_interval * 2, self.max_reconnect_interval)
+                    next_reconnect = time.monotonic() + reconnect_interval
+                time.sleep(min(self.idle_delay * 2 ** min(misses, 16), self.max_backoff))
+                continue
+
+            now = time.monotonic()
+            if self._last_frame_time is not None:
+                gap = now - self._last_frame_time
+                if gap >= self.gap_threshold:
+                    self.frame_gaps += 1
+                    self.longest_gap = max(self.longest_gap, gap)
+            self._last_frame_time = now
+            misses = 0
+            reconnect_interval = self.reconnect_after
+            next_reconnect = now + reconnect_interval
+            timestamp = time.time()
+
+            buffer = self._write_buffer
+            if buffer is None or buffer.shape != frame.shape or buffer.dtype != frame.dtype:
+                buffer = np.empty_like(frame)
+            np.copyto(buffer, frame)
+
+            with self._lock:
+                self._write_buffer = self._latest_buffer
+                self._latest_buffer = buffer
+                self._latest_timestamp = timestamp
+                self._latest_seq += 1
+                self.captured_frames += 1
+                self._frame_ready.notify_all()
+
+    def read(self, timeout: float = 1.0) -> Optional[FramePacket]:
+        """Возвращает самый свежий ещё не прочитанный кадр.
+
+        Ждёт новый кадр не дольше timeout секунд, иначе возвращает None.
+        Массив кадра остаётся валидным до следующего вызова read().
+        """
+        with self._lock:
+            has_frame = self._frame_ready.wait_for(
+                lambda: self._latest_seq > self._last_read_seq or not self._running,
+                timeout=timeout
+            )
+            if not has_frame or self._latest_seq == self._last_read_seq:
+                return None
+
+            self.dropped_frames += self._latest_seq - self._last_read_seq - 1
+            self._last_read_seq = self._latest_seq
+            self._read_buffer, self._latest_buffer = self._latest_buffer, self._read_buffer
+            return FramePacket(self._read_buffer, self._latest_timestamp, self._latest_seq)
@@ -0,0 +1,221 @@
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class PyramidArucoDetector:
+    """Пирамидальная детекция маркеров ArUco.
+
+    Кандидаты ищутся на уменьшенном полутоновом изображении, затем углы
+    уточняются субпиксельно на кадре полного разрешения только в окнах вокруг
+    найденных углов. Масштаб подбирается по размеру маркера на предыдущем кадре:
+    чем крупнее маркер в кадре, тем сильнее уменьшается изображение. Пока
+    маркеров не видно, детекция идет в полном разрешении.
+
+    detect() возвращает то же, что ArucoDetector.detectMarkers().
+    """
+
+    def __init__(self, aruco_detector, min_marker_side: float = 48, min_scale: float = 0.25):
+        self.aruco_detector = aruco_detector
+        self.min_marker_side = min_marker_side  # сторона маркера (px) на уменьшенном кадре
+        self.min_scale = min_scale
+        self.last_marker_side: Optional[float] = None
+        self.last_scale = 1.0
+        self.subpix_criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
+    def _select_scale(self) -> float:
+        if self.last_marker_side is None:
+            return 1.0
+        scale = self.min_marker_side / self.last_marker_side
+        return float(np.clip(scale, self.min_scale, 1.0))
+
+    def detect(self, frame: np.ndarray, gray: Optional[np.ndarray] = None):
+        if gray is None:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+        scale = self._select_scale()
+        self.last_scale = scale
+        if scale >= 1.0:
+            corners, ids, rejected = self.aruco_detector.detectMarkers(gray)
+        else:
+            small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            small_corners, ids, rejected = self.aruco_detector.detectMarkers(small)
+            corners = self._refine(gray, small_corners, scale)
+            rejected = tuple(self._to_full_resolution(c, scale) for c in rejected)
+
+        if ids is None or len(corners) == 0:
+            self.last_marker_side = None
+            return corners, ids, rejected
+
+        quads = np.concatenate(corners).reshape(-1, 4, 2)
+        sides = np.linalg.norm(quads - np.roll(quads, -1, axis=1), axis=2)
+        self.last_marker_side = float(sides.mean(axis=1).min())
+        return corners, ids, rejected
+
+    @staticmethod
+    def _to_full_resolution(points: np.ndarray, scale: float) -> np.ndarray:
+        # Пересчет с учетом того, что координаты относятся к центрам пикселей
+        return ((points + 0.5) / scale - 0.5).astype(np.float32)
+
+    def _refine(self, gray: np.ndarray, small_corners, scale: float):
+        """Перенос углов на полное разрешение и субпиксельное уточнение"""
+        if not small_corners:
+            return small_corners
+        # Окно уточнения покрывает погрешность масштабирования
+        half_window = int(np.clip(np.ceil(1.0 / scale) + 1, 2, 10))
+        refined = []
+        for marker_corners in small_corners:
+            full_corners = self._to_full_resolution(marker_corners, scale).reshape(-1, 1, 2)
+            cv2.cornerSubPix(gray, full_corners, (half_window, half_window), (-1, -1), self.subpix_criteria)
+            refined.append(full_corners.reshape(1, 4, 2))
+        return tuple(refined)
+
+
+def marker_confidences(quads: np.ndarray) -> np.ndarray:
+    """Уверенность детекции для массива углов (N, 4, 2): мин. сторона / макс. сторона"""
+    sides = np.linalg.norm(quads - np.roll(quads, -1, axis=1), axis=2)
+    return sides.min(axis=1) / np.maximum(sides.max(axis=1), 1e-6)
+
+
+class FrameMarkers:
+    """Маркеры одного кадра: проверка и оценка положения с кэшированием.
+
+    Уверенность и центры считаются одной операцией по массиву углов (N, 4, 2).
+    Положение каждого маркера вычисляется не больше одного раза за кадр и
+    используется и при выборе ближайшего маркера, и в управлении.
+    pose_solver принимает углы (4, 2) и ID маркера и возвращает (rvec, tvec, distance) или None.
+    """
+
+    def __init__(self, corners, ids, pose_solver):
+        self.quads = np.concatenate(corners).reshape(-1, 4, 2).astype(np.float32)
+        self.ids = np.asarray(ids).reshape(-1)
+        self.confidence = marker_confidences(self.quads)
+        self.centers = self.quads.mean(axis=1)
+        self._pose_solver = pose_solver
+        self._poses = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def valid_indices(self, confidence_threshold: float, excluded_ids=()) -> np.ndarray:
+        """Индексы маркеров с достаточной уверенностью, не входящих в excluded_ids"""
+        mask = self.confidence >= confidence_threshold
+        if excluded_ids:
+            mask &= ~np.isin(self.ids, list(excluded_ids))
+        return np.flatnonzero(mask)
+
+    def index_of(self, marker_id, indices) -> Optional[int]:
+        for i in indices:
+            if self.ids[i] == marker_id:
+                return int(i)
+        return None
+
+    def pose(self, i: int):
+        """(rvec, tvec, distance) маркера i или None, если положение не найдено"""
+        if i not in self._poses:
+            try:
+                self._poses[i] = self._pose_solver(self.quads[i], int(self.ids[i]))
+            except Exception as e:
+                print(f"Ошибка при расчете положения маркера {self.ids[i]}: {str(e)}")
+                self._poses[i] = None
+        return self._poses[i]
+
+    def distance(self, i: int) -> Optional[float]:
+        pose = self.pose(i)
+        return pose[2] if pose else None
+
+    def nearest(self, indices) -> Optional[int]:
+        """Индекс ближайшего маркера среди indices"""
+        nearest_idx = None
+        min_distance = float('inf')
+        for i in indices:
+            distance = self.distance(i)
+            if distance is not None and distance < min_distance:
+                min_distance = distance
+                nearest_idx = int(i)
+        return nearest_idx
+
+
+class MarkerTracker:
+    """Сопровождение заблокированного маркера между кадрами.
+
+    Четыре угла маркера переносятся на следующий кадр разреженным оптическим
+    потоком Лукаса-Канаде с проверкой прямым и обратным проходом. Полная
+    детекция нужна раз в redetect_interval кадров или когда уверенность
+    сопровождения падает ниже min_confidence.
+    """
+
+    def __init__(self, redetect_interval: int = 5, min_confidence: float = 0.6,
+                 max_fb_error: float = 1.5, min_shape_confidence: float = 0.65):
+        self.redetect_interval = redetect_interval
+        self.min_confidence = min_confidence
+        self.max_fb_error = max_fb_error  # допустимая ошибка прямого/обратного прохода (px)
+        self.min_shape_confidence = min_shape_confidence
+        self.lk_params = dict(
+            winSize=(21, 21),
+            maxLevel=3,
+            criteria=(cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+        )
+        self.marker_id = None
+        self.corners: Optional[np.ndarray] = None
+        self.confidence = 0.0
+        self.frames_since_detection = 0
+        self._prev_gray: Optional[np.ndarray] = None
+
+    @property
+    def active(self) -> bool:
+        return self.marker_id is not None
+
+    def reset(self):
+        self.marker_id = None
+        self.corners = None
+        self.confidence = 0.0
+        self.frames_since_detection = 0
+
+    def start(self, gray: np.ndarray, corners: np.ndarray, marker_id: int):
+        """Начало сопровождения по углам, найденным полной детекцией"""
+        self.marker_id = marker_id
+        self.corners = np.asarray(corners, dtype=np.float32).reshape(4, 2).copy()
+        self.confidence = 1.0
+        self.frames_since_detection = 0
+        self._store_gray(gray)
+
+    def _store_gray(self, gray: np.ndarray):
+        # Предыдущий кадр хранится в собственном буфере: вызывающий код может переиспользовать свой
+        if self._prev_gray is None or self._prev_gray.shape != gray.shape:
+            self._prev_gray = np.empty_like(gray)
+        np.copyto(self._prev_gray, gray)
+
+    def needs_detection(self) -> bool:
+        return not self.active or self.frames_since_detection >= self.redetect_interval
+
+    def track(self, gray: np.ndarray) -> Optional[np.ndarray]:
+        """Углы маркера (4, 2) на новом кадре или None при потере сопровождения"""
+        if not self.active:
+            return None
+
+        points = self.corners.reshape(-1, 1, 2)
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, points, None, **self.lk_params)
+        if next_points is None:
+            self.reset()
+            return None
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, next_points, None, **self.lk_params)
+        if back_points is None:
+            self.reset()
+            return None
+
+        fb_error = np.linalg.norm((back_points - points).reshape(-1, 2), axis=1)
+        good = (status.reshape(-1) == 1) & (back_status.reshape(-1) == 1) & (fb_error <= self.max_fb_error)
+        quad = next_points.reshape(4, 2)
+        shape_confidence = float(marker_confidences(quad[None])[0])
+
+        self.confidence = float(good.mean()) * min(1.0, shape_confidence / self.min_shape_confidence)
+        if not good.all() or self.confidence < self.min_confidence:
+            self.reset()
+            return None
+
+        self.corners = quad
+        self.frames_since_detection += 1
+        self._store_gray(gray)
+        return quad.copy()
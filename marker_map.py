@@ -0,0 +1,206 @@
+import json
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+
+# Нормаль маркера по умолчанию: маркер смотрит навстречу курсу yaw=0
+DEFAULT_NORMAL = np.array([0.0, -1.0, 0.0])
+
+
+def camera_to_local_direction(vector, heading: float = 0.0) -> np.ndarray:
+    """Вектор из системы камеры в локальную систему при курсе дрона heading.
+
+    Камера: x - вправо, y - вниз, z - вперед. Локальная система: при курсе 0
+    (yaw=0) x - вправо, y - вперед, z - вверх; курс в градусах, + вправо.
+    """
+    x, y, z = np.asarray(vector, dtype=np.float64).reshape(3)
+    angle = np.radians(heading)
+    forward = np.array([np.sin(angle), np.cos(angle), 0.0])
+    right = np.array([np.cos(angle), -np.sin(angle), 0.0])
+    return x * right + z * forward + np.array([0.0, 0.0, -y])
+
+
+def camera_to_local(drone_position, tvec, heading: float = 0.0) -> np.ndarray:
+    """Положение маркера в локальной системе по положению и курсу дрона и tvec камеры.
+
+    Смещение камеры относительно центра дрона не учитывается.
+    """
+    return np.asarray(drone_position, dtype=np.float64)[:3] + camera_to_local_direction(tvec, heading)
+
+
+def _horizontal_unit(vector) -> Optional[np.ndarray]:
+    horizontal = np.array([vector[0], vector[1], 0.0], dtype=np.float64)
+    norm = np.linalg.norm(horizontal)
+    return None if norm < 1e-6 else horizontal / norm
+
+
+class MarkerMap:
+    """Карта положений маркеров в локальной системе дрона с сохранением в JSON.
+
+    Положение маркера и горизонтальная нормаль его плоскости (направление
+    от маркера к камере) уточняются скользящим средним по наблюдениям на
+    остановках. Сдвиг локальной системы текущего полета относительно карты
+    (другое место взлета, дрейф одометрии) оценивается медианой невязок
+    повторно наблюденных маркеров, когда их не меньше min_drift_samples,
+    и учитывается в точках подлета. Маркер, невязка которого после учета
+    сдвига больше outlier_threshold, считается перемещенным: его положение
+    заменяется новым наблюдением.
+    """
+
+    def __init__(self, path: Optional[str] = None, drift_threshold: float = 0.3,
+                 outlier_threshold: float = 0.5, min_drift_samples: int = 2, max_observations: int = 20):
+        self.path = path
+        self.drift_threshold = drift_threshold      # сдвиг системы, о котором предупреждаем, м
+        self.outlier_threshold = outlier_threshold  # невязка перемещенного маркера, м
+        self.min_drift_samples = min_drift_samples
+        self.max_observations = max_observations    # предел веса истории в скользящем среднем
+        self.markers: Dict[int, Dict] = {}
+        self.offset = np.zeros(3)  # сдвиг локальной системы полета относительно карты
+        self.drift_detected = False
+        self._flight_samples: Dict[int, np.ndarray] = {}
+        self.updated = 0
+        self.moved = 0
+
+    def __contains__(self, marker_id) -> bool:
+        return int(marker_id) in self.markers
+
+    def __len__(self):
+        return len(self.markers)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> 'MarkerMap':
+        marker_map = cls(path, **kwargs)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            for marker_id, entry in data.get('markers', {}).items():
+                normal = entry.get('normal')
+                marker_map.markers[int(marker_id)] = {
+                    'position': np.array(entry['position'], dtype=np.float64),
+                    'normal': None if normal is None else np.array(normal, dtype=np.float64),
+                    'observations': int(entry.get('observations', 1)),
+                    'updated': entry.get('updated'),
+                }
+            print(f"✅ Загружена карта маркеров: {len(marker_map)} маркеров ({path})")
+        return marker_map
+
+    def save(self):
+        if not self.path:
+            return
+        data = {
+            'markers': {
+                str(marker_id): {
+                    'position': [round(float(v), 4) for v in entry['position']],
+                    'normal': None if entry['normal'] is None else [round(float(v), 4) for v in entry['normal']],
+                    'observations': entry['observations'],
+                    'updated': entry['updated'],
+                }
+                for marker_id, entry in sorted(self.markers.items())
+            }
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    def _update_offset(self):
+        if len(self._flight_samples) < self.min_drift_samples:
+            self.offset = np.zeros(3)
+            return
+        self.offset = np.median(np.array(list(self._flight_samples.values())), axis=0)
+        if not self.drift_detected and np.linalg.norm(self.offset) > self.drift_threshold:
+            self.drift_detected = True
+            print(f"⚠️ Локальная система сместилась относительно карты на "
+                  f"{np.linalg.norm(self.offset):.2f} м, точки подлета поправлены")
+
+    def add_observation(self, marker_id: int, position, normal=None) -> str:
+        """Наблюдение маркера в локальной системе полета: 'new', 'updated', 'pending' или 'moved'.
+
+        normal - нормаль плоскости маркера в локальной системе или None.
+        """
+        marker_id = int(marker_id)
+        position = np.asarray(position, dtype=np.float64).reshape(3)
+        normal = None if normal is None else _horizontal_unit(normal)
+        entry = self.markers.get(marker_id)
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+        if entry is None:
+            self.markers[marker_id] = {
+                'position': position - self.offset, 'normal': normal, 'observations': 1, 'updated': now
+            }
+            self.updated += 1
+            return 'new'
+
+        self._flight_samples[marker_id] = position - entry['position']
+        self._update_offset()
+        residual = position - self.offset - entry['position']
+        if np.linalg.norm(residual) > self.outlier_threshold:
+            if len(self._flight_samples) < self.min_drift_samples:
+                # Пока не понятно, сдвинулась система или маркер: карту не меняем
+                return 'pending'
+            print(f"⚠️ Маркер {marker_id} смещен на {np.linalg.norm(residual):.2f} м от карты, положение заменено")
+            del self._flight_samples[marker_id]
+            self._update_offset()
+            self.markers[marker_id] = {
+                'position': position - self.offset, 'normal': normal, 'observations': 1, 'updated': now
+            }
+            self.moved += 1
+            return 'moved'
+
+        entry['observations'] += 1
+        weight = 1.0 / min(entry['observations'], self.max_observations)
+        entry['position'] = entry['position'] + weight * residual
+        if normal is not None:
+            if entry['normal'] is None:
+                entry['normal'] = normal
+            else:
+                entry['normal'] = _horizontal_unit(entry['normal'] + weight * (normal - entry['normal']))
+        entry['updated'] = now
+        self.updated += 1
+        return 'updated'
+
+    def position(self, marker_id: int) -> Optional[np.ndarray]:
+        """Положение маркера в локальной системе текущего полета"""
+        entry = self.markers.get(int(marker_id))
+        return None if entry is None else entry['position'] + self.offset
+
+    def normal(self, marker_id: int) -> np.ndarray:
+        """Нормаль маркера (от маркера к камере); без наблюдений нормали - навстречу курсу 0"""
+        entry = self.markers.get(int(marker_id))
+        if entry is None or entry['normal'] is None:
+            return DEFAULT_NORMAL.copy()
+        return entry['normal']
+
+    def approach_point(self, marker_id: int, distance: float) -> Optional[np.ndarray]:
+        """Точка подлета: на distance перед маркером по его нормали на его высоте"""
+        position = self.position(marker_id)
+        return None if position is None else position + self.normal(marker_id) * distance
+
+    def approach_heading(self, marker_id: int) -> float:
+        """Курс (градусы, + вправо), при котором камера смотрит на маркер"""
+        normal = self.normal(marker_id)
+        return float(np.degrees(np.arctan2(-normal[0], -normal[1])))
+
+    def nearest(self, marker_ids: Iterable[int], position=None) -> Optional[int]:
+        """Ближайший к position маркер карты из marker_ids (без положения - первый)"""
+        candidates = [int(m) for m in marker_ids if int(m) in self.markers]
+        if not candidates:
+            return None
+        if position is None:
+            return candidates[0]
+        position = np.asarray(position, dtype=np.float64)[:3]
+        return min(candidates, key=lambda m: np.linalg.norm(self.position(m) - position))
+
+    def summary(self) -> Dict:
+        return {
+            'markers': len(self.markers),
+            'updated': self.updated,
+            'moved': self.moved,
+            'offset': [round(float(v), 3) for v in self.offset],
+        }
@@ -0,0 +1,118 @@
+import threading
+import time
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+
+def draw_overlay(frame: np.ndarray, overlay: Dict):
+    """Отрисовка служебной информации полета на кадре"""
+    center = overlay.get('marker_center')
+    if center is not None:
+        x_center, y_center = center
+        dot_size = 5
+        cv2.rectangle(frame,
+                      (x_center - dot_size, y_center - dot_size),
+                      (x_center + dot_size, y_center + dot_size),
+                      (0, 0, 255), -1)
+
+    if overlay.get('marker_corners'):
+        cv2.aruco.drawDetectedMarkers(frame, overlay['marker_corners'])
+
+    cv2.putText(frame, overlay['mode_text'], (10, 25),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+
+    confidence = overlay.get('confidence')
+    if confidence is not None:
+        confidence_color = (0, 255, 0) if confidence >= overlay['confidence_threshold'] else (0, 0, 255)
+        cv2.putText(frame, f"Confidence: {confidence:.2f}", (10, 50),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, confidence_color, 2)
+
+    if overlay.get('scanned_markers'):
+        scanned_text = f"Scanned ArUco: {overlay['scanned_markers']}"
+        cv2.putText(frame, scanned_text, (10, frame.shape[0] - 15),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+
+    retreat_elapsed = overlay.get('retreat_elapsed')
+    if retreat_elapsed is not None:
+        cv2.putText(frame, f"Retreat: {retreat_elapsed:.1f} sec", (10, frame.shape[0] - 40),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+
+
+class OverlayViewer:
+    """Окно просмотра полета в отдельном потоке.
+
+    Цикл полета передает кадр и описание оверлея через submit(): кадр
+    копируется в переиспользуемый буфер не чаще max_fps раз в секунду, а вся
+    отрисовка и работа с окном OpenCV идут в потоке просмотра и не блокируют
+    управление. ESC или закрытие окна выставляют stop_requested.
+    """
+
+    def __init__(self, window_name: str, max_fps: float = 15.0):
+        self.window_name = window_name
+        self.frame_interval = 1.0 / max_fps
+        self._lock = threading.Lock()
+        self._submit_buffer: Optional[np.ndarray] = None
+        self._render_buffer: Optional[np.ndarray] = None
+        self._overlay: Optional[Dict] = None
+        self._has_new_frame = False
+        self._last_submit = 0.0
+        self._running = False
+        self._thread = None
+        self.stop_requested = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._render_loop, name="overlay-viewer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def submit(self, frame: np.ndarray, overlay: Dict):
+        """Передача кадра на отображение (лишние кадры сверх max_fps отбрасываются)"""
+        now = time.monotonic()
+        if now - self._last_submit < self.frame_interval:
+            return
+        self._last_submit = now
+        with self._lock:
+            if self._submit_buffer is None or self._submit_buffer.shape != frame.shape:
+                self._submit_buffer = np.empty_like(frame)
+            np.copyto(self._submit_buffer, frame)
+            self._overlay = overlay
+            self._has_new_frame = True
+
+    def _render_loop(self):
+        cv2.namedWindow(self.window_name)
+        try:
+            while self._running:
+                overlay = None
+                with self._lock:
+                    if self._has_new_frame:
+                        self._render_buffer, self._submit_buffer = self._submit_buffer, self._render_buffer
+                        overlay = self._overlay
+                        self._has_new_frame = False
+
+                if overlay is not None:
+                    draw_overlay(self._render_buffer, overlay)
+                    cv2.imshow(self.window_name, self._render_buffer)
+
+                key = cv2.waitKey(max(1, int(self.frame_interval * 1000)))
+                if key == 27 or cv2.getWindowProperty(self.window_name, cv2.WND_PROP_VISIBLE) < 1:
+                    print("Получен сигнал завершения (ESC или окно закрыто)")
+                    self.stop_requested = True
+                    break
+        except Exception as e:
+            print(f"Ошибка окна просмотра: {str(e)}")
+        finally:
+            try:
+                cv2.destroyWindow(self.window_name)
+            except Exception:
+                pass
@@ -0,0 +1,165 @@
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Решатель работает в нормализованных координатах (после undistortPoints)
+_NORMALIZED_CAMERA = np.eye(3, dtype=np.float64)
+_REFINE_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 5, 1e-7)
+
+
+def square_marker_points(marker_size: float) -> np.ndarray:
+    """Углы квадратного маркера в порядке ArUco и SOLVEPNP_IPPE_SQUARE"""
+    half = marker_size / 2
+    return np.array(
+        [(-half, half, 0), (half, half, 0), (half, -half, 0), (-half, -half, 0)],
+        dtype=np.float64
+    )
+
+
+def distance_from_size(normalized_points: np.ndarray, marker_size: float) -> float:
+    """Дистанция до маркера по видимому размеру (без решения PnP).
+
+    В нормализованных координатах фокус равен 1, поэтому дистанция равна
+    отношению стороны маркера к корню из площади его изображения.
+    """
+    points = np.asarray(normalized_points, dtype=np.float64).reshape(4, 2)
+    x, y = points[:, 0], points[:, 1]
+    area = 0.5 * abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
+    if area <= 1e-12:
+        return float('inf')
+    return marker_size / float(np.sqrt(area))
+
+
+def _reprojection_error(object_points, image_points, rvec, tvec) -> float:
+    projected, _ = cv2.projectPoints(object_points, rvec, tvec, _NORMALIZED_CAMERA, None)
+    return float(np.sqrt(np.mean(np.sum((projected.reshape(-1, 2) - image_points.reshape(-1, 2)) ** 2, axis=1))))
+
+
+class MarkerPoseEstimator:
+    """Положение квадратного маркера с теплым стартом.
+
+    Полное решение - SOLVEPNP_IPPE_SQUARE: из двух возможных поз плоского
+    квадрата выбирается ближайшая к предыдущей, что убирает скачки между
+    кадрами. Если предыдущая поза маркера свежая, она только уточняется
+    несколькими итерациями Левенберга-Марквардта; полное решение
+    выполняется при большом скачке или ошибке репроекции. Возраст позы
+    считается по часам clock (при воспроизведении - время кадров записи).
+    """
+
+    def __init__(self, marker_size: float, max_jump: float = 0.15, max_age: float = 0.5,
+                 max_reprojection_error: float = 0.003, clock: Callable[[], float] = time.monotonic):
+        self.marker_size = marker_size
+        self.clock = clock
+        self.object_points = square_marker_points(marker_size)
+        self.max_jump = max_jump  # допустимое смещение между кадрами при теплом старте, м
+        self.max_age = max_age    # возраст предыдущей позы, с
+        # Ошибка в нормализованных координатах (0.003 - около 3 px при фокусе ~900 px)
+        self.max_reprojection_error = max_reprojection_error
+        self._previous: Dict[int, Tuple[np.ndarray, np.ndarray, float]] = {}
+        self.warm_solves = 0
+        self.full_solves = 0
+
+    def reset(self, marker_id: Optional[int] = None):
+        if marker_id is None:
+            self._previous.clear()
+        else:
+            self._previous.pop(marker_id, None)
+
+    def _warm_start(self, image_points, marker_id):
+        previous = self._previous.get(marker_id)
+        if previous is None or self.clock() - previous[2] > self.max_age:
+            return None
+        rvec, tvec = previous[0].copy(), previous[1].copy()
+        rvec, tvec = cv2.solvePnPRefineLM(
+            self.object_points, image_points, _NORMALIZED_CAMERA, None, rvec, tvec, _REFINE_CRITERIA
+        )
+        if np.linalg.norm(tvec - previous[1]) > self.max_jump:
+            return None
+        if _reprojection_error(self.object_points, image_points, rvec, tvec) > self.max_reprojection_error:
+            return None
+        return rvec, tvec
+
+    def _full_solve(self, image_points, marker_id):
+        count, rvecs, tvecs, errors = cv2.solvePnPGeneric(
+            self.object_points, image_points, _NORMALIZED_CAMERA, None, flags=cv2.SOLVEPNP_IPPE_SQUARE
+        )
+        if not count:
+            return None
+        best = 0
+        previous = self._previous.get(marker_id)
+        if previous is not None and count > 1:
+            # Неоднозначность плоского квадрата: берем решение, ближайшее к прошлому повороту
+            best = int(np.argmin([np.linalg.norm(rvec - previous[0]) for rvec in rvecs]))
+        return rvecs[best], tvecs[best]
+
+    def estimate(self, normalized_points: np.ndarray, marker_id: Optional[int] = None):
+        """(rvec, tvec, distance) по нормализованным углам маркера (4, 2) или None"""
+        image_points = np.asarray(normalized_points, dtype=np.float64).reshape(4, 1, 2)
+        pose = None
+        if marker_id is not None:
+            pose = self._warm_start(image_points, marker_id)
+        if pose is not None:
+            self.warm_solves += 1
+        else:
+            pose = self._full_solve(image_points, marker_id)
+            if pose is None:
+                return None
+            self.full_solves += 1
+
+        rvec, tvec = pose
+        if marker_id is not None:
+            self._previous[marker_id] = (rvec, tvec, self.clock())
+        return rvec, tvec, float(np.linalg.norm(tvec))
+
+    def stats_summary(self) -> str:
+        return f"теплый старт {self.warm_solves}, полное решение {self.full_solves}"
+
+
+class BoardPoseEstimator:
+    """Совместное положение нескольких маркеров одной полки (доски).
+
+    layouts: ключ доски -> {ID маркера: (x, y) центра маркера в плоскости
+    доски, м; x - вправо, y - вверх}. Поза решается по всем углам видимых
+    маркеров доски (SOLVEPNP_IPPE для плоскости), при свежей предыдущей
+    позе - итеративно от нее. Возраст позы считается по часам clock.
+    """
+
+    def __init__(self, layouts: Dict, marker_size: float, max_age: float = 0.5,
+                 clock: Callable[[], float] = time.monotonic):
+        self.layouts = layouts
+        self.max_age = max_age
+        self.clock = clock
+        self._marker_points = square_marker_points(marker_size)
+        self._previous: Dict = {}
+
+    def object_points(self, board_key, ids) -> np.ndarray:
+        layout = self.layouts[board_key]
+        return np.concatenate([
+            self._marker_points + np.array([*layout[int(marker_id)], 0.0]) for marker_id in ids
+        ])
+
+    def estimate(self, normalized_points: np.ndarray, ids, board_key, target_id: int):
+        """(rvec, tvec, distance) доски; distance - до центра маркера target_id"""
+        object_points = self.object_points(board_key, ids)
+        image_points = np.asarray(normalized_points, dtype=np.float64).reshape(-1, 1, 2)
+        previous = self._previous.get(board_key)
+        if previous is not None and self.clock() - previous[2] <= self.max_age:
+            success, rvec, tvec = cv2.solvePnP(
+                object_points, image_points, _NORMALIZED_CAMERA, None,
+                previous[0].copy(), previous[1].copy(), True, cv2.SOLVEPNP_ITERATIVE
+            )
+        else:
+            success, rvec, tvec = cv2.solvePnP(
+                object_points, image_points, _NORMALIZED_CAMERA, None, flags=cv2.SOLVEPNP_IPPE
+            )
+        if not success:
+            self._previous.pop(board_key, None)
+            return None
+        self._previous[board_key] = (rvec, tvec, self.clock())
+
+        rotation, _ = cv2.Rodrigues(rvec)
+        target_center = np.array([*self.layouts[board_key][int(target_id)], 0.0])
+        target_position = rotation @ target_center + tvec.reshape(3)
+        return rvec, tvec, float(np.linalg.norm(target_position))
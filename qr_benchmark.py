@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from config import FRAME_HEIGHT, FRAME_WIDTH
+from qr_decoding import DEFAULT_QR_VARIANTS, QR_BACKENDS, QRDecodeCascade, create_qr_detector
+
+
+def load_labelled_images(folder: str, labels_path: Optional[str] = None) -> List[Tuple[str, np.ndarray, List[str]]]:
+    """Размеченный набор: labels.json вида {"кадр.png": ["содержимое QR", ...]}.
+
+    Пустой список означает кадр без QR-кодов (проверка ложных срабатываний).
+    """
+    labels_path = labels_path or os.path.join(folder, 'labels.json')
+    with open(labels_path, encoding='utf-8') as f:
+        labels = json.load(f)
+
+    images = []
+    for name, payloads in sorted(labels.items()):
+        image = cv2.imread(os.path.join(folder, name), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            print(f"⚠️ Не удалось прочитать {name}, пропускаю")
+            continue
+        images.append((name, image, list(payloads)))
+    return images
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def benchmark_backend(backend: str, images, frame_size: Tuple[int, int],
+                      variants: Sequence[str] = DEFAULT_QR_VARIANTS) -> Dict:
+    """Прогон одной реализации детектора по набору кадров заданного размера"""
+    detector = create_qr_detector(backend)
+    cascade = QRDecodeCascade(detector, variants=variants)
+    resized = [
+        (name, cv2.resize(image, frame_size, interpolation=cv2.INTER_AREA), payloads)
+        for name, image, payloads in images
+    ]
+    # Первый вызов инициализирует внутренние структуры детектора и в замер не входит.
+    # Прогрев идет через отдельный каскад, чтобы не влиять на статистику и выбор варианта
+    QRDecodeCascade(detector, variants=variants).decode_multi(resized[0][1])
+
+    latencies = []
+    expected = found = wrong = 0
+    for name, image, payloads in resized:
+        started = time.perf_counter()
+        results = cascade.decode_multi(image)
+        latencies.append(time.perf_counter() - started)
+
+        decoded = {string for string, _, _ in results}
+        expected += len(payloads)
+        found += len(decoded & set(payloads))
+        wrong += len(decoded - set(payloads))
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'backend': backend,
+        'frame_size': f"{frame_size[0]}x{frame_size[1]}",
+        'images': len(resized),
+        'decode_rate': found / expected if expected else 0.0,
+        'wrong_decodes': wrong,
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'variant_stats': cascade.stats_summary(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение реализаций детектора QR на размеченных кадрах")
+    parser.add_argument('folder', help="каталог с кадрами и файлом labels.json")
+    parser.add_argument('--labels', help="файл разметки (по умолчанию <каталог>/labels.json)")
+    parser.add_argument('--backends', nargs='+', default=list(QR_BACKENDS), choices=list(QR_BACKENDS))
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=[(FRAME_WIDTH, FRAME_HEIGHT)],
+                        help="размеры кадра ШИРИНАxВЫСОТА")
+    parser.add_argument('--variants', nargs='+', default=list(DEFAULT_QR_VARIANTS), help="варианты предобработки")
+    parser.add_argument('--output', help="файл для результатов (JSON)")
+    args = parser.parse_args(argv)
+
+    images = load_labelled_images(args.folder, args.labels)
+    if not images:
+        print("❌ Нет кадров для сравнения")
+        return []
+    print(f"Кадров в наборе: {len(images)}")
+
+    results = []
+    for frame_size in args.sizes:
+        for backend in args.backends:
+            result = benchmark_backend(backend, images, frame_size, args.variants)
+            results.append(result)
+            print(f"{result['backend']:>14} {result['frame_size']:>9}: "
+                  f"распознано {result['decode_rate'] * 100:5.1f}%, ошибочных {result['wrong_decodes']}, "
+                  f"среднее {result['mean_ms']:.1f} мс, p50 {result['p50_ms']:.1f} мс, p95 {result['p95_ms']:.1f} мс")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from frame_preprocessing import PREPROCESSING_VARIANTS
+
+# Варианты предобработки кадра перед декодированием QR
+QR_PREPROCESSORS = PREPROCESSING_VARIANTS
+
+DEFAULT_QR_VARIANTS = ('raw', 'blur5', 'blur7')
+
+# Реализации детектора QR. Все поддерживают detectAndDecode и detectAndDecodeMulti
+QR_BACKENDS: Dict[str, Callable[[], object]] = {
+    'opencv': lambda: cv2.QRCodeDetector(),
+    'opencv_aruco': lambda: cv2.QRCodeDetectorAruco(),
+}
+
+
+def create_qr_detector(backend: str = 'opencv'):
+    """Создание детектора QR по имени реализации из QR_BACKENDS"""
+    if backend not in QR_BACKENDS:
+        raise ValueError(f"Неизвестная реализация детектора QR: {backend}. Доступны: {', '.join(QR_BACKENDS)}")
+    return QR_BACKENDS[backend]()
+
+
+def qr_points_size(points: np.ndarray) -> float:
+    """Размер QR-кода в пикселях (минимум из ширины и высоты)"""
+    qr_width = np.max(points[0][:, 0]) - np.min(points[0][:, 0])
+    qr_height = np.max(points[0][:, 1]) - np.min(points[0][:, 1])
+    return float(min(qr_width, qr_height))
+
+
+class QRDecodeCascade:
+    """Каскад декодирования QR с ранним выходом.
+
+    Варианты предобработки перебираются по порядку до первого уверенного
+    декодирования. Вариант, сработавший последним, пробуется первым на
+    следующих кадрах. По каждому варианту ведется статистика попаданий,
+    чтобы порядок можно было настроить по реальным полетам.
+    """
+
+    def __init__(self, detector, variants: Sequence[str] = DEFAULT_QR_VARIANTS, min_qr_size: float = 0):
+        unknown = [name for name in variants if name not in QR_PREPROCESSORS]
+        if unknown:
+            raise ValueError(f"Неизвестные варианты предобработки QR: {unknown}")
+        if not variants:
+            raise ValueError("Список вариантов предобработки QR пуст")
+        self.detector = detector
+        self.variants: List[str] = list(variants)
+        self.min_qr_size = min_qr_size
+        self.preferred_variant: Optional[str] = None
+        self.attempts = {name: 0 for name in self.variants}
+        self.hits = {name: 0 for name in self.variants}
+
+    def _ordered_variants(self) -> List[str]:
+        if self.preferred_variant is None:
+            return self.variants
+        return [self.preferred_variant] + [v for v in self.variants if v != self.preferred_variant]
+
+    def _preprocess(self, frame, name, variant_provider):
+        if variant_provider is not None:
+            return variant_provider(name)
+        return QR_PREPROCESSORS[name](frame, None)
+
+    def decode(self, frame: Optional[np.ndarray], variant_provider=None) -> Optional[Tuple[str, np.ndarray, float, str]]:
+        """Возвращает (строка, точки, размер, вариант) или None.
+
+        variant_provider(name) может отдавать уже подготовленные варианты
+        (см. FramePreprocessor), тогда frame не используется.
+        """
+        for name in self._ordered_variants():
+            processed_frame = self._preprocess(frame, name, variant_provider)
+            self.attempts[name] += 1
+            string, points, _ = self.detector.detectAndDecode(processed_frame)
+
+            if string and points is not None and not np.any(np.isnan(points)):
+                qr_size = qr_points_size(points)
+                if qr_size >= self.min_qr_size:
+                    self.hits[name] += 1
+                    self.preferred_variant = name
+                    return string, points, qr_size, name
+        return None
+
+    def decode_multi(self, frame: Optional[np.ndarray], variant_provider=None) -> List[Tuple[str, np.ndarray, float]]:
+        """Все QR-коды кадра: список (строка, точки, размер).
+
+        Варианты предобработки перебираются так же, как в decode(); выход на
+        первом варианте, который дал хотя бы один уверенный результат.
+        """
+        for name in self._ordered_variants():
+            processed_frame = self._preprocess(frame, name, variant_provider)
+            self.attempts[name] += 1
+            ok, strings, points, _ = self.detector.detectAndDecodeMulti(processed_frame)
+            if not ok or points is None:
+                continue
+
+            results = []
+            for string, qr_points in zip(strings, points):
+                qr_points = qr_points.reshape(1, 4, 2)
+                if not string or np.any(np.isnan(qr_points)):
+                    continue
+                qr_size = qr_points_size(qr_points)
+                if qr_size >= self.min_qr_size:
+                    results.append((string, qr_points, qr_size))
+
+            if results:
+                self.hits[name] += 1
+                self.preferred_variant = name
+                return results
+        return []
+
+    def hit_rates(self) -> Dict[str, float]:
+        """Доля успешных декодирований по каждому варианту"""
+        return {
+            name: (self.hits[name] / self.attempts[name]) if self.attempts[name] else 0.0
+            for name in self.variants
+        }
+
+    def stats_summary(self) -> str:
+        rates = self.hit_rates()
+        return ", ".join(
+            f"{name}: {self.hits[name]}/{self.attempts[name]} ({rates[name] * 100:.0f}%)"
+            for name in self.variants
+        )
+
+
+def sharpness_score(gray: np.ndarray, max_side: int = 160) -> float:
+    """Резкость изображения: дисперсия лапласиана на уменьшенной копии"""
+    height, width = gray.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))),
+                          interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+
+class SharpnessGate:
+    """Отсев смазанных кадров перед декодированием QR.
+
+    Порог адаптивный: кадр пропускается, если его резкость не ниже ratio от
+    резкости лучших кадров скользящего окна (90-й перцентиль), поэтому порог
+    подстраивается под освещение и текстуру полки. Пока окно не набрано,
+    кадры не отсеиваются; после max_gated отсеянных подряд один кадр
+    пропускается всегда, чтобы сканирование не зависло на размытой сцене.
+    """
+
+    def __init__(self, ratio: float = 0.6, window: int = 30, min_samples: int = 5,
+                 min_score: float = 0.0, max_gated: int = 10, max_side: int = 160):
+        self.ratio = ratio
+        self.min_samples = min_samples
+        self.min_score = min_score
+        self.max_gated = max_gated
+        self.max_side = max_side
+        self._scores = deque(maxlen=window)
+        self._gated_in_row = 0
+        self.last_score = 0.0
+        self.threshold = 0.0
+        self.gated_frames = 0
+        self.passed_frames = 0
+
+    def reset(self):
+        """Сброс окна (новая остановка - другая сцена)"""
+        self._scores.clear()
+        self._gated_in_row = 0
+        self.threshold = 0.0
+
+    def check(self, gray: np.ndarray) -> bool:
+        """True, если кадр достаточно резкий для декодирования"""
+        score = sharpness_score(gray, self.max_side)
+        self.last_score = score
+        self._scores.append(score)
+        if len(self._scores) >= self.min_samples:
+            self.threshold = max(self.min_score, self.ratio * float(np.percentile(self._scores, 90)))
+        else:
+            self.threshold = self.min_score
+
+        if score < self.threshold and self._gated_in_row < self.max_gated:
+            self._gated_in_row += 1
+            self.gated_frames += 1
+            return False
+        self._gated_in_row = 0
+        self.passed_frames += 1
+        return True
+
+    def stats_summary(self) -> str:
+        total = self.gated_frames + self.passed_frames
+        share = self.gated_frames / total * 100 if total else 0.0
+        return f"отсеяно {self.gated_frames} из {total} ({share:.0f}%), порог {self.threshold:.1f}"
+
+
+class _QRTrack:
+    """Один QR-код в кадре: положение и голоса за его содержимое"""
+
+    def __init__(self, center: np.ndarray, size: float, window: int, frame_index: int):
+        self.center = center
+        self.size = size
+        self.votes = deque(maxlen=window)
+        self.observations = 0
+        self.last_seen = frame_index
+        self.resolved = False
+
+    def add(self, string: str, center: np.ndarray, size: float, frame_index: int):
+        # Положение сглаживается: дрон на остановке медленно смещается
+        self.center = 0.7 * self.center + 0.3 * center
+        self.size = 0.7 * self.size + 0.3 * size
+        self.votes.append(string)
+        self.observations += 1
+        self.last_seen = frame_index
+
+
+class QRVoteAggregator:
+    """Голосование по декодированиям QR за последние кадры.
+
+    Декодирования группируются по положению кода в кадре, поэтому частичные
+    и искаженные чтения одного кода попадают в одну группу. Содержимое
+    принимается, когда набирает min_votes голосов и долю min_share в окне
+    из window последних чтений. Если за max_observations чтений ни один
+    вариант не победил, код считается нечитаемым и возвращается как
+    отклоненный (побеждающий на тот момент вариант).
+    """
+
+    def __init__(self, window: int = 8, min_votes: int = 3, min_share: float = 0.6,
+                 max_distance: float = 0.75, max_observations: Optional[int] = None):
+        self.window = window
+        self.min_votes = min_votes
+        self.min_share = min_share
+        self.max_distance = max_distance  # в размерах QR-кода
+        self.max_observations = max_observations or window * 3
+        self._tracks: List[_QRTrack] = []
+        self._frame_index = 0
+        self.accepted = set()
+
+    def reset(self):
+        """Сброс групп перед новой остановкой"""
+        self._tracks = []
+        self._frame_index = 0
+        self.accepted = set()
+
+    @property
+    def pending(self) -> bool:
+        """Есть коды, по которым голосование еще идет"""
+        return any(
+            not track.resolved and self._frame_index - track.last_seen <= self.window
+            for track in self._tracks
+        )
+
+    def _match(self, center: np.ndarray, size: float) -> Optional[_QRTrack]:
+        best, best_distance = None, None
+        for track in self._tracks:
+            distance = np.linalg.norm(track.center - center) / max(track.size, size, 1.0)
+            if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                best, best_distance = track, distance
+        return best
+
+    def add_frame(self, detections) -> Tuple[List[str], List[str]]:
+        """Учет декодирований кадра: список (строка, точки, размер).
+
+        Возвращает (принятые, отклоненные) - содержимое, по которому
+        голосование завершилось на этом кадре.
+        """
+        self._frame_index += 1
+        updated = []
+        for string, points, qr_size in detections:
+            center = np.asarray(points, dtype=np.float64).reshape(-1, 2).mean(axis=0)
+            track = self._match(center, qr_size)
+            if track is None:
+                track = _QRTrack(center, qr_size, self.window, self._frame_index)
+                self._tracks.append(track)
+            track.add(string, center, qr_size, self._frame_index)
+            updated.append(track)
+
+        accepted, rejected = [], []
+        for track in updated:
+            if track.resolved:
+                continue
+            payload, votes = Counter(track.votes).most_common(1)[0]
+            if votes >= self.min_votes and votes / len(track.votes) >= self.min_share:
+                track.resolved = True
+                if payload not in self.accepted:
+                    self.accepted.add(payload)
+                    accepted.append(payload)
+            elif track.observations >= self.max_observations:
+                track.resolved = True
+                rejected.append(payload)
+
+        # Давно не видимые нерешенные группы удаляются (код ушел из кадра)
+        self._tracks = [
+            track for track in self._tracks
+            if track.resolved or self._frame_index - track.last_seen <= self.window * 2
+        ]
+        return accepted, rejected
+
+
+# Квадрат маркера в собственных координатах (в долях стороны), порядок углов ArUco
+_MARKER_UNIT_SQUARE = np.array(
+    [(-0.5, -0.5), (0.5, -0.5), (0.5, 0.5), (-0.5, 0.5)], dtype=np.float32
+)
+
+
+def marker_guided_roi(marker_corners: np.ndarray, layout: Dict, frame_shape: Tuple[int, ...]) -> Optional[Tuple[int, int, int, int]]:
+    """Область поиска QR по углам маркера ArUco.
+
+    layout задает центр ('offset') и размер ('size') области в сторонах маркера
+    в плоскости маркера (x - вправо, y - вниз). Область переносится на кадр
+    гомографией маркера, поэтому учитывает его масштаб, поворот и наклон.
+    Возвращает (x0, y0, x1, y1) в пикселях или None, если область вне кадра.
+    """
+    corners = np.asarray(marker_corners, dtype=np.float32).reshape(4, 2)
+    homography = cv2.getPerspectiveTransform(_MARKER_UNIT_SQUARE, corners)
+
+    offset_x, offset_y = layout['offset']
+    half_w, half_h = layout['size'][0] / 2, layout['size'][1] / 2
+    region = np.array([
+        (offset_x - half_w, offset_y - half_h),
+        (offset_x + half_w, offset_y - half_h),
+        (offset_x + half_w, offset_y + half_h),
+        (offset_x - half_w, offset_y + half_h),
+    ], dtype=np.float32).reshape(-1, 1, 2)
+    projected = cv2.perspectiveTransform(region, homography).reshape(-1, 2)
+
+    frame_height, frame_width = frame_shape[:2]
+    x0 = int(max(0, np.floor(projected[:, 0].min())))
+    y0 = int(max(0, np.floor(projected[:, 1].min())))
+    x1 = int(min(frame_width, np.ceil(projected[:, 0].max())))
+    y1 = int(min(frame_height, np.ceil(projected[:, 1].max())))
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return None
+    return x0, y0, x1, y1
@@ -0,0 +1,217 @@
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+from typing import Any, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from qr_decoding import QR_BACKENDS, QR_PREPROCESSORS, create_qr_detector, qr_points_size
+
+# Заголовок слота разделяемой памяти: номер задания, записанного в слот.
+# -1 означает, что слот сейчас перезаписывается.
+_HEADER_BYTES = 8
+
+
+def _decode_image(detector, image: np.ndarray, multi: bool, min_qr_size: float) -> List[Tuple[str, np.ndarray, float]]:
+    results = []
+    if multi:
+        ok, strings, points, _ = detector.detectAndDecodeMulti(image)
+        if not ok or points is None:
+            return results
+        candidates = zip(strings, points)
+    else:
+        string, points, _ = detector.detectAndDecode(image)
+        if points is None:
+            return results
+        candidates = [(string, points)]
+
+    for string, qr_points in candidates:
+        qr_points = np.asarray(qr_points, dtype=np.float32).reshape(1, 4, 2)
+        if not string or np.any(np.isnan(qr_points)):
+            continue
+        qr_size = qr_points_size(qr_points)
+        if qr_size >= min_qr_size:
+            results.append((string, qr_points, qr_size))
+    return results
+
+
+def _decode_worker(variant: str, min_qr_size: float, backend: str, job_queue, result_queue):
+    """Процесс декодирования: один вариант предобработки на процесс"""
+    cv2.setNumThreads(1)
+    detector = create_qr_detector(backend)
+    preprocess = QR_PREPROCESSORS[variant]
+    segment = None  # разделяемая память текущего слота родителя
+    header = None
+    try:
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+            job_id, shm_name, shape, dtype, multi = job
+            try:
+                if segment is None or segment.name != shm_name:
+                    # Родитель перевыделил слот: старый сегмент закрываем, иначе он остается открытым
+                    header = None
+                    if segment is not None:
+                        segment.close()
+                    segment = shared_memory.SharedMemory(name=shm_name)
+                buf = segment.buf
+                header = np.ndarray((1,), dtype=np.int64, buffer=buf)
+                if header[0] != job_id:
+                    result_queue.put((job_id, variant, None))
+                    continue
+                image = np.ndarray(shape, dtype=dtype, buffer=buf, offset=_HEADER_BYTES).copy()
+                # Кадр перезаписали во время копирования - задание устарело
+                if header[0] != job_id:
+                    result_queue.put((job_id, variant, None))
+                    continue
+                results = _decode_image(detector, preprocess(image, None), multi, min_qr_size)
+                result_queue.put((job_id, variant, results))
+            except Exception as e:
+                print(f"Ошибка в процессе декодирования QR ({variant}): {str(e)}")
+                result_queue.put((job_id, variant, None))
+    finally:
+        header = None
+        if segment is not None:
+            segment.close()
+
+
+class QRDecodePool:
+    """Пул процессов для декодирования QR с ограничением времени на кадр.
+
+    Кадр (или область) передается процессам через разделяемую память, каждый
+    процесс пробует свой вариант предобработки. Побеждает первый успешный
+    результат, пришедший в пределах deadline секунд. submit() и poll() не
+    блокируют, поэтому цикл управления продолжает работать, пока идет
+    декодирование.
+    """
+
+    def __init__(self, variants: Sequence[str], deadline: float = 0.25, min_qr_size: float = 0,
+                 backend: str = 'opencv'):
+        unknown = [name for name in variants if name not in QR_PREPROCESSORS]
+        if unknown:
+            raise ValueError(f"Неизвестные варианты предобработки QR: {unknown}")
+        if backend not in QR_BACKENDS:
+            raise ValueError(f"Неизвестная реализация детектора QR: {backend}")
+        self.backend = backend
+        self.variants = list(variants)
+        self.deadline = deadline
+        self.min_qr_size = min_qr_size
+        self._result_queue = mp.Queue()
+        self._job_queues = []
+        self._workers = []
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._job_id = 0
+        self._job_start = 0.0
+        self._job_context: Any = None
+        self._pending = set()  # варианты, от которых еще ждем ответ
+        self._in_flight = False
+        self.hits = {name: 0 for name in self.variants}
+        self.jobs = 0
+        self.timeouts = 0
+
+    def start(self):
+        for variant in self.variants:
+            job_queue = mp.Queue()
+            worker = mp.Process(
+                target=_decode_worker,
+                args=(variant, self.min_qr_size, self.backend, job_queue, self._result_queue),
+                name=f"qr-decode-{variant}",
+                daemon=True
+            )
+            worker.start()
+            self._job_queues.append(job_queue)
+            self._workers.append(worker)
+
+    def close(self):
+        for job_queue in self._job_queues:
+            try:
+                job_queue.put(None)
+            except Exception:
+                pass
+        for worker in self._workers:
+            worker.join(timeout=1.0)
+            if worker.is_alive():
+                worker.terminate()
+        self._job_queues = []
+        self._workers = []
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    @property
+    def busy(self) -> bool:
+        return self._in_flight
+
+    def _ensure_segment(self, nbytes: int):
+        if self._shm is not None and self._shm.size >= nbytes + _HEADER_BYTES:
+            return
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+        self._shm = shared_memory.SharedMemory(create=True, size=nbytes + _HEADER_BYTES)
+
+    def submit(self, image: np.ndarray, multi: bool = False, context: Any = None) -> bool:
+        """Отправка изображения на декодирование; False, если пул еще занят"""
+        if self._in_flight or not self._workers:
+            return False
+
+        image = np.ascontiguousarray(image)
+        self._ensure_segment(image.nbytes)
+        self._job_id += 1
+        buf = self._shm.buf
+        header = np.ndarray((1,), dtype=np.int64, buffer=buf)
+        header[0] = -1
+        np.ndarray(image.shape, dtype=image.dtype, buffer=buf, offset=_HEADER_BYTES)[...] = image
+        header[0] = self._job_id
+
+        job = (self._job_id, self._shm.name, image.shape, image.dtype.str, multi)
+        for job_queue in self._job_queues:
+            job_queue.put(job)
+        self._job_start = time.time()
+        self._job_context = context
+        self._pending = set(self.variants)
+        self._in_flight = True
+        self.jobs += 1
+        return True
+
+    def poll(self) -> Optional[Tuple[Optional[List[Tuple[str, np.ndarray, float]]], Any]]:
+        """Результат текущего задания, если оно завершилось.
+
+        Возвращает (результаты или None, context) после первого успешного ответа,
+        после ответа всех процессов или по истечении deadline; пока задание
+        выполняется или пул свободен - None.
+        """
+        if not self._in_flight:
+            return None
+
+        while True:
+            try:
+                job_id, variant, results = self._result_queue.get_nowait()
+            except queue.Empty:
+                break
+            if job_id != self._job_id:
+                continue
+            self._pending.discard(variant)
+            if results:
+                self.hits[variant] += 1
+                return self._finish(results)
+
+        if not self._pending:
+            return self._finish(None)
+        if time.time() - self._job_start > self.deadline:
+            self.timeouts += 1
+            return self._finish(None)
+        return None
+
+    def _finish(self, results):
+        self._in_flight = False
+        context, self._job_context = self._job_context, None
+        return results, context
+
+    def stats_summary(self) -> str:
+        hits = ", ".join(f"{name}: {self.hits[name]}" for name in self.variants)
+        return f"заданий {self.jobs}, по истечении времени {self.timeouts}, успехи по вариантам: {hits}"
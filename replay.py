@@ -0,0 +1,288 @@
+import argparse
+import bisect
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import cv2
+
+from flight import ArucoFlight
+from frame_source import FramePacket
+from marker_map import MarkerMap
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+class ReplayFrameSource:
+    """Источник кадров из записи: каталог изображений или видеофайл.
+
+    Повторяет интерфейс LatestFrameGrabber, но отдает каждый кадр по порядку
+    и без ожидания. Время кадра берется из журнала телеметрии (поле 'frame_t'
+    по номеру кадра) или вычисляется по частоте кадров. После последнего кадра
+    is_running становится False.
+    """
+
+    def __init__(self, path: str, fps: float = 30.0, frame_times: Optional[List[float]] = None):
+        self.path = path
+        self.fps = fps
+        self.frame_times = frame_times
+        self._files: Optional[List[str]] = None
+        self._capture = None
+        self._index = 0
+        self._running = False
+        self.current_time = 0.0
+        self.captured_frames = 0
+        self.dropped_frames = 0
+        self.frame_gaps = 0
+        self.longest_gap = 0.0
+        self.reconnects = 0
+        self.on_frame = None  # вызывается перед выдачей каждого кадра
+
+    def start(self):
+        if os.path.isdir(self.path):
+            self._files = sorted(
+                os.path.join(self.path, name) for name in os.listdir(self.path)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+            if not self._files:
+                raise Exception(f"В каталоге {self.path} нет изображений")
+        else:
+            self._capture = cv2.VideoCapture(self.path)
+            if not self._capture.isOpened():
+                raise Exception(f"Не удалось открыть видео {self.path}")
+            video_fps = self._capture.get(cv2.CAP_PROP_FPS)
+            if video_fps and video_fps > 0:
+                self.fps = video_fps
+        self._running = True
+
+    def stop(self, timeout: float = 0.0):
+        self._running = False
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    def clock(self) -> float:
+        """Время текущего кадра записи"""
+        return self.current_time
+
+    def _frame_time(self, index: int) -> float:
+        if self.frame_times and index < len(self.frame_times):
+            return self.frame_times[index]
+        return index / self.fps
+
+    def _next_frame(self):
+        if self._files is not None:
+            if self._index >= len(self._files):
+                return None
+            return cv2.imread(self._files[self._index])
+        ok, frame = self._capture.read()
+        return frame if ok else None
+
+    def read(self, timeout: float = 0.0) -> Optional[FramePacket]:
+        if not self._running:
+            return None
+        frame = self._next_frame()
+        if frame is None:
+            self.stop()
+            return None
+
+        self.current_time = self._frame_time(self._index)
+        self._index += 1
+        self.captured_frames += 1
+        packet = FramePacket(frame, self.current_time, self._index)
+        if self.on_frame:
+            self.on_frame(packet)
+        return packet
+
+    def skip(self, seconds: float):
+        """Пропуск кадров записи за указанное время (аналог паузы в полете)"""
+        end_time = self.current_time + seconds
+        while self._running and self._frame_time(self._index) < end_time:
+            if self._next_frame() is None:
+                self.stop()
+                break
+            self.current_time = self._frame_time(self._index)
+            self._index += 1
+            self.dropped_frames += 1
+        self.current_time = max(self.current_time, end_time)
+
+
+def load_telemetry(path: str) -> List[Dict]:
+    """Журнал телеметрии: JSON-строки с полем 't' и значениями x, y, z, yaw"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda r: r['t'])
+    return records
+
+
+class RecordingDrone:
+    """Заглушка дрона для воспроизведения: записывает команды вместо отправки.
+
+    Телеметрия (положение) берется из журнала по времени текущего кадра.
+    """
+
+    def __init__(self, clock, telemetry: Optional[List[Dict]] = None):
+        self.clock = clock
+        self.telemetry = telemetry or []
+        self._telemetry_times = [r['t'] for r in self.telemetry]
+        self.commands: List[Dict] = []
+
+    def _record(self, name, **kwargs):
+        self.commands.append({'t': self.clock(), 'command': name, **kwargs})
+
+    def telemetry_at(self, t: float) -> Optional[Dict]:
+        if not self.telemetry:
+            return None
+        index = bisect.bisect_right(self._telemetry_times, t) - 1
+        return self.telemetry[max(index, 0)]
+
+    def arm(self):
+        self._record('arm')
+
+    def takeoff(self):
+        self._record('takeoff')
+
+    def land(self):
+        self._record('land')
+
+    def go_to_local_point(self, x, y, z, yaw):
+        self._record('go_to_local_point', x=x, y=y, z=z, yaw=yaw)
+
+    def point_reached(self):
+        return True
+
+    def set_manual_speed_body_fixed(self, vx, vy, vz, yaw_rate):
+        self._record('set_manual_speed_body_fixed', vx=float(vx), vy=float(vy), vz=float(vz), yaw_rate=float(yaw_rate))
+
+    def get_local_position_lps(self, get_last_received=False):
+        record = self.telemetry_at(self.clock())
+        if record is None:
+            return None
+        return [record.get('x', 0.0), record.get('y', 0.0), record.get('z', 0.0)]
+
+    def close_connection(self):
+        pass
+
+
+class ReplayFlight(ArucoFlight):
+    """ArucoFlight с записью решений вместо полета и записи в базу"""
+
+    def __init__(self, source: ReplayFrameSource, drone: RecordingDrone):
+        super().__init__()
+        self.frame_grabber = source
+        self.mini = drone
+        self.clock = source.clock
+        self.sleep = source.skip
+        self.headless = True
+        # Файл остановки относится к настоящему полету на этой машине, запись его не трогает
+        self.stop_file = None
+        # Регулятор шагает из цикла по времени кадров, чтобы прогон был воспроизводимым
+        self.speed_settings['control_thread'] = False
+        # Запись не повторяет перелеты по карте; карта строится в памяти и не сохраняется
+        self.speed_settings['map_navigation'] = False
+        self.marker_map = MarkerMap()
+        self._load_camera_calibration()
+        self.decisions: List[Dict] = []
+        self.current_packet = None
+        self._commands_seen = 0
+
+    def flush_decision(self):
+        """Запись решений по текущему кадру: выданные команды и маркеры"""
+        if self.current_packet is None:
+            return
+        commands = self.mini.commands[self._commands_seen:]
+        self._commands_seen = len(self.mini.commands)
+        self.decisions.append({
+            'seq': self.current_packet.seq,
+            't': round(self.current_packet.timestamp, 3),
+            'locked_marker': None if self.locked_marker_id is None else int(self.locked_marker_id),
+            'aruco_id': None if self.current_aruco_id is None else int(self.current_aruco_id),
+            'commands': commands,
+        })
+        self.current_packet = None
+
+    def process_qr_data(self, qr_data):
+        self.scanned_qr_codes.add(qr_data)
+        self.scan_results['scanned_qr'].add(qr_data)
+        self.mini.commands.append({
+            't': self.clock(), 'command': 'qr', 'data': qr_data,
+            'aruco_id': None if self.current_aruco_id is None else int(self.current_aruco_id)
+        })
+        return True
+
+    def save_scan_results(self):
+        pass
+
+    def safe_landing(self, signum=None, frame=None):
+        self.frame_grabber.stop()
+
+
+def run_replay(path: str, telemetry_path: Optional[str] = None, fps: float = 30.0,
+               output_path: Optional[str] = None) -> Dict:
+    """Прогон записи через цикл ArucoFlight без дрона и окна"""
+    telemetry = load_telemetry(telemetry_path) if telemetry_path else None
+    frame_times = [r['frame_t'] for r in telemetry if 'frame_t' in r] if telemetry else None
+
+    source = ReplayFrameSource(path, fps=fps, frame_times=frame_times or None)
+    drone = RecordingDrone(source.clock, telemetry)
+    flight = ReplayFlight(source, drone)
+    decisions = flight.decisions
+
+    def on_frame(packet):
+        # Закрываем запись предыдущего кадра: команды, выданные при его обработке
+        flight.flush_decision()
+        flight.current_packet = packet
+
+    source.on_frame = on_frame
+    source.start()
+
+    started = time.perf_counter()
+    flight.fly()
+    flight.flush_decision()
+    elapsed = time.perf_counter() - started
+
+    frames = source.captured_frames
+    summary = {
+        'frames': frames,
+        'skipped_frames': source.dropped_frames,
+        'elapsed': elapsed,
+        'fps': frames / elapsed if elapsed > 0 else 0.0,
+        'commands': len(drone.commands),
+        'qr_codes': sorted(flight.scanned_qr_codes),
+        'markers': sorted(int(m) for m in flight.scanned_markers),
+    }
+    if flight.metrics.enabled:
+        summary['stage_latency'] = flight.metrics.summary()
+
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for decision in decisions:
+                f.write(json.dumps(decision, ensure_ascii=False) + '\n')
+            f.write(json.dumps({'summary': summary}, ensure_ascii=False) + '\n')
+
+    print(f"Кадров: {frames}, время: {elapsed:.2f} с, скорость: {summary['fps']:.1f} кадр/с")
+    print(f"Команд дрону: {summary['commands']}, QR-кодов: {len(summary['qr_codes'])}, маркеров: {summary['markers']}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Воспроизведение записи полета через систему зрения")
+    parser.add_argument('path', help="каталог с кадрами или видеофайл")
+    parser.add_argument('--telemetry', help="журнал телеметрии (JSON-строки)")
+    parser.add_argument('--fps', type=float, default=30.0, help="частота кадров для каталога изображений")
+    parser.add_argument('--output', help="файл для покадровых решений (JSON-строки)")
+    args = parser.parse_args(argv)
+    run_replay(args.path, args.telemetry, args.fps, args.output)
+
+
+if __name__ == "__main__":
+    main()
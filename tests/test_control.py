@@ -0,0 +1,235 @@
+import numpy as np
+import pytest
+
+from control import (DEFAULT_GAIN_PROFILE, ControlEstimate, MarkerApproachController, PIDAxis,
+                     PoseStabilityMonitor, heading_to_local_yaw, wait_until)
+
+
+class FakeClock:
+    """Часы и sleep для детерминированных тестов ожидания"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_wait_until_returns_immediately_when_condition_holds():
+    clock = FakeClock()
+    assert wait_until(lambda: True, timeout=1.0, sleep=clock.sleep, clock=clock)
+    assert clock.sleeps == []
+
+
+def test_wait_until_polls_until_condition():
+    clock = FakeClock()
+    assert wait_until(lambda: clock.now >= 0.3, timeout=1.0, poll_interval=0.1, sleep=clock.sleep, clock=clock)
+    assert clock.now == pytest.approx(0.3)
+    assert all(seconds == pytest.approx(0.1) for seconds in clock.sleeps)
+
+
+def test_wait_until_times_out_without_oversleeping():
+    clock = FakeClock()
+    # Значения точно представимы в двоичном виде, чтобы не было лишнего микросна
+    assert not wait_until(lambda: False, timeout=0.3125, poll_interval=0.125, sleep=clock.sleep, clock=clock)
+    # Последний сон укорачивается до оставшегося времени
+    assert clock.now == 0.3125
+    assert clock.sleeps == [0.125, 0.125, 0.0625]
+
+
+def test_wait_until_cancel_stops_waiting():
+    clock = FakeClock()
+    assert not wait_until(lambda: False, timeout=10.0, poll_interval=0.1,
+                          cancel=lambda: clock.now >= 0.2, sleep=clock.sleep, clock=clock)
+    assert clock.now == pytest.approx(0.2)
+
+
+def test_wait_until_condition_wins_over_cancel():
+    clock = FakeClock()
+    assert wait_until(lambda: True, timeout=1.0, cancel=lambda: True, sleep=clock.sleep, clock=clock)
+
+
+def test_stability_requires_full_window():
+    monitor = PoseStabilityMonitor(window=4)
+    for _ in range(3):
+        monitor.add(1.35, 320, 240)
+    assert not monitor.stable
+    monitor.add(1.35, 320, 240)
+    assert monitor.stable
+
+
+def test_stability_distance_spread_threshold():
+    monitor = PoseStabilityMonitor(window=4, max_distance_std=0.02)
+    for distance in (1.30, 1.40, 1.30, 1.40):  # СКО 0.05 м
+        monitor.add(distance, 320, 240)
+    assert not monitor.stable
+
+    monitor.reset()
+    for distance in (1.34, 1.36, 1.34, 1.36):  # СКО 0.01 м
+        monitor.add(distance, 320, 240)
+    assert monitor.stable
+
+
+def test_stability_center_spread_threshold():
+    monitor = PoseStabilityMonitor(window=4, max_center_std=5.0)
+    for y_center in (230, 250, 230, 250):  # СКО 10 px по вертикали
+        monitor.add(1.35, 320, y_center)
+    assert not monitor.stable
+
+
+def test_stability_window_slides_past_old_samples():
+    monitor = PoseStabilityMonitor(window=3)
+    monitor.add(2.0, 100, 100)
+    for _ in range(2):
+        monitor.add(1.35, 320, 240)
+    assert not monitor.stable
+    monitor.add(1.35, 320, 240)
+    assert monitor.stable
+
+
+def test_stability_reset_empties_window():
+    monitor = PoseStabilityMonitor(window=2)
+    monitor.add(1.35, 320, 240)
+    monitor.add(1.35, 320, 240)
+    assert monitor.stable
+    monitor.reset()
+    assert not monitor.stable
+
+
+# Регулятор подлета
+
+SPEED_SETTINGS = {
+    'target_distance': 1.35,
+    'distance_threshold': 0.05,
+    'max_speed': 0.18,
+    'centering_speed': 0.12,
+    'vertical_speed': 0.09,
+    'yaw_speed': 0.1,
+}
+
+
+def approach_controller(**kwargs):
+    gains = {axis: dict(axis_gains) for axis, axis_gains in DEFAULT_GAIN_PROFILE.items()}
+    return MarkerApproachController(SPEED_SETTINGS, gains, **kwargs)
+
+
+def estimate(timestamp, marker_id=1, distance=1.35, x_center=320, y_center=240):
+    return ControlEstimate(timestamp, marker_id, distance, x_center, y_center, 640, 480)
+
+
+def test_pid_integral_frozen_while_saturated():
+    axis = PIDAxis(kp=1.0, ki=1.0, limit=0.5)
+    for _ in range(20):
+        assert axis.update(2.0, 0.1) == pytest.approx(0.5)
+    assert axis.integral == 0.0
+    # После насыщения нет накопленного интеграла: выход сразу следует за ошибкой
+    assert axis.update(-0.1, 0.1) == pytest.approx(-0.1 - 0.01)
+
+
+def test_pid_integral_limited():
+    axis = PIDAxis(kp=0.0, ki=1.0, limit=10.0, integral_limit=0.3)
+    for _ in range(5):
+        output = axis.update(1.0, 1.0)
+    assert axis.integral == pytest.approx(0.3)
+    assert output == pytest.approx(0.3)
+
+
+def test_pid_feed_forward_only_outside_deadband():
+    axis = PIDAxis(kp=0.0, kff=0.05, deadband=0.1, limit=1.0)
+    assert axis.update(0.05, 0.0) == 0.0
+    assert axis.update(0.2, 0.0) == pytest.approx(0.05)
+    assert axis.update(-0.2, 0.0) == pytest.approx(-0.05)
+
+
+def test_pid_reset():
+    axis = PIDAxis(kp=0.0, ki=1.0, kd=1.0, limit=10.0)
+    axis.update(1.0, 0.5)
+    axis.reset()
+    assert axis.integral == 0.0
+    assert axis.previous_error is None
+    # Первый шаг после сброса без производной
+    assert axis.update(1.0, 0.5) == pytest.approx(0.5)
+
+
+# Знаки команд совпадают с прежним законом calculate_control_speed:
+# маркер правее центра - vx > 0 и yaw_rate > 0, ниже центра - vz < 0,
+# дальше целевой дистанции - vy > 0 (вперед), ближе - vy < 0
+@pytest.mark.parametrize('kwargs, signs', [
+    ({'x_center': 400}, (1, 0, 0, 1)),
+    ({'x_center': 240}, (-1, 0, 0, -1)),
+    ({'y_center': 300}, (0, 0, -1, 0)),
+    ({'y_center': 180}, (0, 0, 1, 0)),
+    ({'distance': 2.0}, (0, 1, 0, 0)),
+    ({'distance': 1.0}, (0, -1, 0, 0)),
+])
+def test_approach_sign_conventions(kwargs, signs):
+    command = approach_controller().command(estimate(0.0, **kwargs))
+    assert tuple(int(np.sign(value)) for value in command) == signs
+
+
+def test_approach_at_target_is_zero():
+    assert approach_controller().command(estimate(0.0)) == (0.0, 0.0, 0.0, 0.0)
+
+
+def test_approach_respects_speed_limits():
+    v_x, v_y, v_z, yaw_rate = approach_controller().command(
+        estimate(0.0, distance=10.0, x_center=639, y_center=479)
+    )
+    assert abs(v_x) <= SPEED_SETTINGS['centering_speed']
+    assert abs(v_z) <= SPEED_SETTINGS['vertical_speed']
+    assert abs(yaw_rate) <= SPEED_SETTINGS['yaw_speed']
+    assert v_y == 0.0  # маркер у края кадра - вперед не летим
+
+
+def test_forward_speed_scaled_by_horizontal_offset():
+    centered = approach_controller().command(estimate(0.0, distance=1.6))[1]
+    quarter = approach_controller().command(estimate(0.0, distance=1.6, x_center=400))[1]
+    cut_off = approach_controller().command(estimate(0.0, distance=1.6, x_center=480))[1]
+    assert centered > 0
+    assert quarter == pytest.approx(centered * 0.5)
+    assert cut_off == 0.0
+
+
+def test_forward_integral_not_accumulated_while_cut_off():
+    controller = approach_controller()
+    for step in range(10):
+        controller.command(estimate(step * 0.1, distance=2.0, x_center=500))
+    assert controller.axes['forward'].integral == 0.0
+
+
+def test_repeated_estimate_does_not_update():
+    controller = approach_controller()
+    controller.command(estimate(0.0, distance=2.0))
+    first = controller.command(estimate(0.1, distance=2.0))
+    integral = controller.axes['forward'].integral
+    assert controller.command(estimate(0.1, distance=2.0)) == first
+    assert controller.axes['forward'].integral == integral
+
+
+def test_reset_on_marker_change():
+    controller = approach_controller()
+    for step in range(5):
+        controller.command(estimate(step * 0.1, distance=2.0, x_center=400))
+    fresh = approach_controller().command(estimate(0.5, marker_id=2, distance=2.0, x_center=400))
+    assert controller.command(estimate(0.5, marker_id=2, distance=2.0, x_center=400)) == pytest.approx(fresh)
+    assert controller.marker_id == 2
+
+
+def test_reset_after_estimate_gap():
+    controller = approach_controller(max_gap=0.5)
+    for step in range(5):
+        controller.command(estimate(step * 0.1, distance=2.0, x_center=400))
+    fresh = approach_controller().command(estimate(1.5, distance=2.0, x_center=400))
+    assert controller.command(estimate(1.5, distance=2.0, x_center=400)) == pytest.approx(fresh)
+
+
+def test_heading_to_local_yaw_sign():
+    # Курс вправо - yaw по часовой стрелке, то есть отрицательный в правой системе с z вверх
+    assert heading_to_local_yaw(90.0) == pytest.approx(-np.pi / 2)
+    assert heading_to_local_yaw(-45.0) == pytest.approx(np.pi / 4)
+    assert heading_to_local_yaw(90.0, sign=1.0) == pytest.approx(np.pi / 2)
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+from marker_map import MarkerMap, camera_to_local
+
+
+def next_flight(marker_map):
+    """Карта прошлого полета в начале нового: те же маркеры, сдвиг и невязки сброшены"""
+    new_map = MarkerMap()
+    new_map.markers = {
+        marker_id: {**entry, 'position': entry['position'].copy()}
+        for marker_id, entry in marker_map.markers.items()
+    }
+    return new_map
+
+
+def map_with(positions):
+    marker_map = MarkerMap()
+    for marker_id, position in positions.items():
+        marker_map.add_observation(marker_id, position)
+    return next_flight(marker_map)
+
+
+def test_running_average_of_observations():
+    marker_map = MarkerMap()
+    assert marker_map.add_observation(1, [0.0, 1.0, 1.0]) == 'new'
+    assert marker_map.add_observation(1, [0.1, 1.0, 1.0]) == 'updated'
+    assert marker_map.position(1) == pytest.approx([0.05, 1.0, 1.0])
+    assert marker_map.add_observation(1, [0.2, 1.0, 1.0]) == 'updated'
+    assert marker_map.position(1) == pytest.approx([0.1, 1.0, 1.0])
+    assert marker_map.markers[1]['observations'] == 3
+
+
+def test_running_average_weight_is_bounded():
+    marker_map = MarkerMap(max_observations=2)
+    for x in (0.0, 0.0, 0.0, 0.0):
+        marker_map.add_observation(1, [x, 1.0, 1.0])
+    marker_map.add_observation(1, [0.2, 1.0, 1.0])
+    # Вес нового наблюдения не меньше 1/max_observations
+    assert marker_map.position(1)[0] == pytest.approx(0.1)
+
+
+def test_single_shifted_marker_waits_for_confirmation():
+    marker_map = map_with({1: [0.0, 1.0, 1.0], 2: [2.0, 1.0, 1.0]})
+    assert marker_map.add_observation(1, [1.0, 1.0, 1.0]) == 'pending'
+    assert marker_map.offset == pytest.approx([0.0, 0.0, 0.0])
+    assert marker_map.markers[1]['position'] == pytest.approx([0.0, 1.0, 1.0])
+
+
+def test_median_offset_detects_frame_drift():
+    marker_map = map_with({1: [0.0, 1.0, 1.0], 2: [2.0, 1.0, 1.0]})
+    marker_map.add_observation(1, [1.0, 1.0, 1.0])
+    assert marker_map.add_observation(2, [3.0, 1.05, 1.0]) == 'updated'
+
+    assert marker_map.drift_detected
+    assert marker_map.offset == pytest.approx([1.0, 0.025, 0.0])
+    # Карта не переписывается, сдвиг учитывается в положениях текущего полета
+    assert marker_map.markers[1]['position'] == pytest.approx([0.0, 1.0, 1.0])
+    assert marker_map.position(1) == pytest.approx([1.0, 1.025, 1.0])
+    # Новый маркер записывается в системе карты
+    marker_map.add_observation(3, [5.0, 1.0, 1.0])
+    assert marker_map.markers[3]['position'] == pytest.approx([4.0, 0.975, 1.0])
+
+
+def test_outlier_marker_is_replaced_as_moved():
+    marker_map = map_with({1: [0.0, 1.0, 1.0], 2: [2.0, 1.0, 1.0], 3: [4.0, 1.0, 1.0]})
+    marker_map.add_observation(1, [1.0, 1.0, 1.0])
+    marker_map.add_observation(2, [3.0, 1.0, 1.0])
+    assert marker_map.add_observation(3, [5.0, 3.0, 1.0]) == 'moved'
+
+    assert marker_map.moved == 1
+    # Невязка перемещенного маркера не влияет на сдвиг системы
+    assert marker_map.offset == pytest.approx([1.0, 0.0, 0.0])
+    assert marker_map.markers[3]['position'] == pytest.approx([4.0, 3.0, 1.0])
+    assert marker_map.markers[3]['observations'] == 1
+
+
+def test_save_load_round_trip(tmp_path):
+    path = str(tmp_path / 'maps' / 'marker_map.json')
+    marker_map = MarkerMap(path)
+    marker_map.add_observation(1, [0.0, 1.0, 1.0], normal=[0.0, -2.0, 0.5])
+    marker_map.add_observation(1, [0.1, 1.0, 1.0])
+    marker_map.add_observation(7, [2.0, 1.5, 0.8])
+    marker_map.save()
+
+    loaded = MarkerMap.load(path)
+    assert len(loaded) == 2 and 1 in loaded and 7 in loaded
+    assert loaded.position(1) == pytest.approx([0.05, 1.0, 1.0])
+    assert loaded.markers[1]['observations'] == 2
+    assert loaded.markers[1]['normal'] == pytest.approx([0.0, -1.0, 0.0])
+    assert loaded.markers[7]['normal'] is None
+    assert loaded.offset == pytest.approx([0.0, 0.0, 0.0])
+
+
+def test_load_missing_file_gives_empty_map(tmp_path):
+    assert len(MarkerMap.load(str(tmp_path / 'absent.json'))) == 0
+
+
+def test_approach_point_follows_marker_normal():
+    marker_map = MarkerMap()
+    marker_map.add_observation(1, [0.0, 2.0, 1.0])
+    marker_map.add_observation(2, [3.0, 0.0, 1.0], normal=[1.0, 0.0, 0.0])
+
+    # Без нормали маркер смотрит навстречу курсу 0
+    assert marker_map.approach_point(1, 1.35) == pytest.approx([0.0, 0.65, 1.0])
+    assert marker_map.approach_heading(1) == pytest.approx(0.0)
+    # Маркер смотрит вправо (+x): подлет справа от него, курс налево
+    assert marker_map.approach_point(2, 1.35) == pytest.approx([4.35, 0.0, 1.0])
+    assert marker_map.approach_heading(2) == pytest.approx(-90.0)
+
+
+def test_nearest_marker_from_position():
+    marker_map = MarkerMap()
+    marker_map.add_observation(1, [0.0, 2.0, 1.0])
+    marker_map.add_observation(2, [3.0, 2.0, 1.0])
+    assert marker_map.nearest([1, 2, 5], [2.5, 0.0, 1.0]) == 2
+    assert marker_map.nearest([5]) is None
+
+
+def test_camera_to_local_rotates_by_heading():
+    position = np.array([1.0, 1.0, 1.0])
+    # Курс 0: вперед камеры - +y, вправо - +x, вниз - -z
+    assert camera_to_local(position, [0.1, 0.2, 1.3]) == pytest.approx([1.1, 2.3, 0.8])
+    # Курс +90 (направо): вперед камеры - +x, вправо - -y
+    assert camera_to_local(position, [0.0, 0.0, 1.0], heading=90.0) == pytest.approx([2.0, 1.0, 1.0])
+    assert camera_to_local(position, [1.0, 0.0, 0.0], heading=90.0) == pytest.approx([1.0, 0.0, 1.0])
@@ -0,0 +1,78 @@
+import numpy as np
+
+from qr_decoding import QRVoteAggregator
+
+
+def qr(string, x, y, size=40.0):
+    """Декодирование QR-кода с центром (x, y) в формате (строка, точки, размер)"""
+    half = size / 2
+    points = np.array([[(x - half, y - half), (x + half, y - half),
+                        (x + half, y + half), (x - half, y + half)]], dtype=np.float32)
+    return string, points, size
+
+
+def test_payload_accepted_after_min_votes():
+    votes = QRVoteAggregator(window=8, min_votes=3, min_share=0.6)
+
+    assert votes.add_frame([qr("A", 100, 100)]) == ([], [])
+    assert votes.add_frame([qr("A", 101, 100)]) == ([], [])
+    assert votes.pending
+    assert votes.add_frame([qr("A", 100, 101)]) == (["A"], [])
+    assert not votes.pending
+    # Принятое содержимое не возвращается повторно
+    assert votes.add_frame([qr("A", 100, 100)]) == ([], [])
+
+
+def test_disagreeing_minority_does_not_win():
+    votes = QRVoteAggregator(window=8, min_votes=3, min_share=0.6)
+
+    results = [votes.add_frame([qr(string, 100, 100)]) for string in ("A", "B", "A")]
+    assert all(result == ([], []) for result in results)
+    # 3 голоса из 4 (доля 0.75) - принимается большинство
+    assert votes.add_frame([qr("A", 100, 100)]) == (["A"], [])
+    assert "B" not in votes.accepted
+
+
+def test_share_below_threshold_is_not_accepted():
+    votes = QRVoteAggregator(window=8, min_votes=3, min_share=0.6)
+
+    for string in ("A", "B", "C", "A", "B", "C", "A"):
+        accepted, rejected = votes.add_frame([qr(string, 100, 100)])
+        # У A три голоса, но доля 3/7 меньше min_share
+        assert accepted == [] and rejected == []
+
+
+def test_rejected_after_max_observations():
+    votes = QRVoteAggregator(window=4, min_votes=3, min_share=0.6)
+    assert votes.max_observations == 12
+
+    payloads = ["A", "B", "C", "D"] * 3
+    for string in payloads[:-1]:
+        assert votes.add_frame([qr(string, 100, 100)]) == ([], [])
+    accepted, rejected = votes.add_frame([qr(payloads[-1], 100, 100)])
+    assert accepted == []
+    assert len(rejected) == 1 and rejected[0] in {"A", "B", "C", "D"}
+    assert not votes.pending
+
+
+def test_codes_grouped_by_position():
+    votes = QRVoteAggregator(window=8, min_votes=3, min_share=0.6)
+
+    for _ in range(2):
+        votes.add_frame([qr("left", 100, 100), qr("right", 300, 100)])
+    # Искаженное чтение рядом с левым кодом голосует в его группе, а не создает новую
+    assert votes.add_frame([qr("lef?", 105, 98), qr("right", 300, 100)]) == (["right"], [])
+    assert votes.add_frame([qr("left", 100, 100)]) == (["left"], [])
+    assert votes.accepted == {"left", "right"}
+
+
+def test_reset_clears_groups_and_accepted():
+    votes = QRVoteAggregator(window=8, min_votes=3, min_share=0.6)
+    for _ in range(3):
+        votes.add_frame([qr("A", 100, 100)])
+    assert votes.accepted == {"A"}
+
+    votes.reset()
+    assert votes.accepted == set()
+    assert not votes.pending
+    assert votes.add_frame([qr("A", 100, 100)]) == ([], [])